@@ -0,0 +1,189 @@
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+from food_catalog import FoodCatalog
+from ranking import TOP_OUTSIDE_CLUSTER, TOP_WITHIN_CLUSTER, top_k
+
+# Rows scanned at a time when walking a presorted order
+SCAN_CHUNK = 64
+# Alternatives kept per food in the precomputed table
+TABLE_TOP_N = 5
+
+logger = logging.getLogger(__name__)
+
+
+class AlternativeIndex:
+    """Alternative-food index built once at startup.
+
+    The signed similarity used by RecommendationEngine.search_alternatives is
+    (target protein - protein) + (carbs - target carbs) + (fats - target fats), so
+    candidates rank by carbs + fats - protein whatever the target is. Each reverse
+    cluster therefore keeps its member rows presorted by that key, and a search only
+    scores the first few members. An optional table of precomputed alternatives per
+    food item (see build_table) turns a search into a dictionary lookup.
+    """
+
+    def __init__(self, catalog, table=None):
+        self.catalog = catalog
+        self.food_names = catalog.food_names
+        self.protein = catalog.arrays["PROTEIN"]
+        self.carbs = catalog.arrays["NET CARBS"]
+        self.fats = catalog.arrays["FATS"]
+        self.reverse_clusters = catalog.arrays["Reverse_Cluster_Number"]
+        self.rank_keys = self.carbs + self.fats - self.protein
+
+        # Searchable rows only, so shadowed duplicate names are never returned
+        rows = np.flatnonzero(catalog.searchable)
+        self.order = rows[np.argsort(self.rank_keys[rows], kind="stable")]
+        self.cluster_members = {
+            cluster: self.order[self.reverse_clusters[self.order] == cluster]
+            for cluster in np.unique(self.reverse_clusters)
+        }
+        self.table = table or {}
+
+    @classmethod
+    def load(cls, catalog, csv_path):
+        """Build the index for the catalog of a CSV, with its precomputed table if one was built.
+
+        A table built from a different catalog (see FoodCatalog.fingerprint) is ignored.
+        """
+        table = None
+        table_path = cls.table_path(csv_path)
+        if os.path.exists(table_path):
+            table, fingerprint = cls.read_table(table_path)
+            if fingerprint != catalog.fingerprint():
+                logger.warning(
+                    "Ignoring %s, built from another version of the food data; "
+                    "rebuild it with: python alternative_index.py %s",
+                    table_path,
+                    csv_path,
+                )
+                table = None
+        return cls(catalog, table)
+
+    @staticmethod
+    def table_path(csv_path):
+        """The precomputed alternatives table is stored alongside the catalog CSV."""
+        root, ext = os.path.splitext(csv_path)
+        return f"{root}_alternatives{ext}"
+
+    def similarities(self, target_index, indices):
+        return (
+            (self.protein[target_index] - self.protein[indices])
+            + (self.carbs[indices] - self.carbs[target_index])
+            + (self.fats[indices] - self.fats[target_index])
+        )
+
+    def ranked(self, order, target_index, k, same_cluster):
+        """Top k rows of a presorted order, excluding the target food (and its cluster if not same_cluster)."""
+        if k <= 0:
+            return np.empty(0, dtype=int)
+        food_name = self.food_names[target_index]
+        cluster = self.reverse_clusters[target_index]
+        selected = []
+        found = 0
+        bound = None
+        for start in range(0, len(order), SCAN_CHUNK):
+            chunk = order[start : start + SCAN_CHUNK]
+            if bound is not None and not self.rank_keys[chunk[0]] <= bound:
+                break
+            keep = self.food_names[chunk] != food_name
+            if not same_cluster:
+                keep &= self.reverse_clusters[chunk] != cluster
+            selected.append(chunk[keep])
+            found += keep.sum()
+            if bound is None and found >= k:
+                kth_key = self.rank_keys[np.concatenate(selected)[k - 1]]
+                # Rounding in the exact similarity can reorder keys this close to the k-th
+                bound = kth_key + 1e-9 * (1 + abs(kth_key))
+        if not selected:
+            return np.empty(0, dtype=int)
+
+        candidates = np.concatenate(selected)
+        if bound is not None and not np.isnan(bound):
+            candidates = candidates[self.rank_keys[candidates] <= bound]
+        # Order by exact similarity, then row order, like a stable full sort
+        return top_k(candidates, self.similarities(target_index, candidates), k)
+
+    def search(
+        self, food_name, top_within=TOP_WITHIN_CLUSTER, top_outside=TOP_OUTSIDE_CLUSTER
+    ):
+        """Return [(alternative, similarity)], the best top_within of the same reverse cluster first."""
+        # The precomputed table holds the default split only
+        default_split = (top_within, top_outside) == (
+            TOP_WITHIN_CLUSTER,
+            TOP_OUTSIDE_CLUSTER,
+        )
+        if default_split and food_name in self.table:
+            return self.table[food_name]
+        target_index = self.catalog.index_of(food_name)
+        if target_index is None:
+            raise ValueError(f"Food item {food_name} not found.")
+        within = self.ranked(
+            self.cluster_members[self.reverse_clusters[target_index]],
+            target_index,
+            top_within,
+            same_cluster=True,
+        )
+        outside = self.ranked(self.order, target_index, top_outside, same_cluster=False)
+        indices = np.concatenate([within, outside])
+        return list(
+            zip(self.food_names[indices], self.similarities(target_index, indices))
+        )
+
+    def build_table(self, top_n=TABLE_TOP_N):
+        """Precompute the alternatives of every food item."""
+        return {
+            name: self.search(name)[:top_n]
+            for name in self.catalog.positions
+            if isinstance(name, str)
+        }
+
+    @staticmethod
+    def write_table(table, table_path, fingerprint):
+        pd.DataFrame(
+            [
+                {
+                    "CATALOG FINGERPRINT": fingerprint,
+                    "FOOD ITEM": name,
+                    "RANK": rank,
+                    "ALTERNATIVE": alternative,
+                    "SIMILARITY": similarity,
+                }
+                for name, alternatives in table.items()
+                for rank, (alternative, similarity) in enumerate(alternatives)
+            ]
+        ).to_csv(table_path, index=False)
+
+    @staticmethod
+    def read_table(table_path):
+        """Return the table and the fingerprint of the catalog it was built from (None if unknown)."""
+        table = {}
+        rows = pd.read_csv(table_path)
+        fingerprint = None
+        if "CATALOG FINGERPRINT" in rows.columns and len(rows):
+            fingerprint = rows["CATALOG FINGERPRINT"].iloc[0]
+        rows = rows.sort_values(["FOOD ITEM", "RANK"])
+        for name, alternative, similarity in zip(
+            rows["FOOD ITEM"], rows["ALTERNATIVE"], rows["SIMILARITY"]
+        ):
+            table.setdefault(name, []).append((alternative, similarity))
+        return table, fingerprint
+
+
+if __name__ == "__main__":
+    # Build the precomputed table offline:
+    #   python alternative_index.py updated_food_data_with_complete_clusters.csv
+    csv_path = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else "updated_food_data_with_complete_clusters.csv"
+    )
+    catalog = FoodCatalog.from_csv(csv_path)
+    index = AlternativeIndex(catalog)
+    table = index.build_table()
+    table_path = AlternativeIndex.table_path(csv_path)
+    AlternativeIndex.write_table(table, table_path, catalog.fingerprint())
+    print(f"Wrote alternatives for {len(table)} foods to {table_path}")
@@ -0,0 +1,286 @@
+import logging
+import os
+from multiprocessing import util
+import config
+import island_ga
+import meal_generator
+import recommendation_rulebase
+from alternative_index import AlternativeIndex
+from food_catalog import FoodCatalog
+from genetic_algo import derive_seed
+from macro_index import MacroIndex
+from meal_generator import MealGenerator, quantize_macros
+from recommendation_rulebase import RecommendationEngine
+from user import User
+import structured_logging
+
+logger = logging.getLogger(__name__)
+
+# Request work for mainApi. It runs in the request worker processes, so the
+# functions take and return plain dicts.
+
+FOOD_DATA_PATH = "updated_food_data_with_complete_clusters.csv"
+SEARCH_MODES = ["similarity", "nearest", "nutrient"]
+
+# Food data and indexes of this process, loaded once by load()
+catalog = None
+alternative_index = None
+macro_index = None
+
+
+def load(food_data_path=FOOD_DATA_PATH):
+    """Load the catalog and its indexes into this process (the worker initializer)."""
+    global catalog, alternative_index, macro_index
+    structured_logging.configure()
+    if catalog is None:
+        catalog = FoodCatalog.from_csv(food_data_path)
+        # Alternative-food index (and precomputed table, if built)
+        alternative_index = AlternativeIndex.load(catalog, food_data_path)
+        # Nearest-neighbour index over macros per 100 kcal, for search="nearest"
+        macro_index = MacroIndex(catalog)
+
+
+def init_worker(food_data_path=FOOD_DATA_PATH):
+    """Initializer of the request worker processes.
+
+    Solver pools created in a worker run on threads, since nested process pools
+    would multiply the processes, and are shut down when the worker exits (before
+    multiprocessing joins the worker's children).
+    """
+    config.MEAL_EXECUTOR = "thread"
+    config.ISLAND_EXECUTOR = "thread"
+    util.Finalize(None, shutdown_solver_pools, exitpriority=10)
+    load(food_data_path)
+
+
+def shutdown_solver_pools():
+    """Shut down the meal and island pools this process created."""
+    meal_generator.shutdown_meal_executor()
+    island_ga.shutdown_island_executor()
+
+
+def ping():
+    """No-op task, submitted at startup so every worker is started and loaded."""
+    return os.getpid()
+
+
+def cache_stats():
+    """This worker's pid and the hit/miss counters of its recommendation caches."""
+    return os.getpid(), recommendation_rulebase.cache_stats()
+
+
+def create_user(user_input):
+    """Create the User for a request and calculate its macros (ValueError if invalid)."""
+    user = User(
+        name=user_input["name"],
+        age=user_input["age"],
+        weight=user_input["weight"],
+        height=user_input["height"],
+        activity_level=user_input["activity_level"],
+        goal=user_input["goal"],  # Include goal
+        gender=user_input["gender"],  # Include gender
+    )
+    user.calculate_macros()
+    logger.debug(
+        "User's target nutrients: Calories=%s, Protein=%s, Carbs=%s, Fats=%s",
+        user.calories,
+        user.protein,
+        user.carbs,
+        user.fats,
+    )
+    return user
+
+
+def user_macros(user):
+    return {
+        "calories": user.calories,
+        "protein": user.protein,
+        "carbs": user.carbs,
+        "fats": user.fats,
+    }
+
+
+def create_bucket_user(user_input):
+    """The request's User with its macros rounded to their quantization bucket."""
+    user = create_user(user_input)
+    for nutrient, value in quantize_macros(user_macros(user)).items():
+        setattr(user, nutrient, value)
+    return user
+
+
+def create_meal_generator(user, meal_selection):
+    """MealGenerator for a request; meal_selection["seed"] must already be set."""
+    return MealGenerator(
+        user,
+        meal_selection["meals"],
+        catalog.df,
+        solver=meal_selection["solver"],
+        target_fitness=meal_selection["target_fitness"],
+        stall_generations=meal_selection["stall_generations"],
+        time_budget_ms=meal_selection["time_budget_ms"],
+        seed=meal_selection["seed"],
+        joint=meal_selection["joint"],
+        catalog=catalog,
+    )
+
+
+def plan_response(user, meal_selection, meal_generator, meal_plan, user_input):
+    """The /generate_meal_plan response for a generated plan."""
+    if not meal_plan:
+        logger.error("Meal plan generation failed for user: %s", user_input["name"])
+        raise ValueError("Meal plan generation failed.")
+
+    # Calculate adjusted macros
+    adjusted_macros = meal_generator.calculate_adjusted_macros(
+        user, meal_selection["meals"]
+    )
+
+    # Calculate actual macros from the meal plan
+    actual_macros = {}
+    for meal_name, details in meal_plan.items():
+        actual_macros[meal_name] = details["macros"]
+
+    # Calculate the differences between target macros and actual meal plan macros
+    macro_differences = meal_generator.calculate_macro_differences(
+        adjusted_macros, actual_macros
+    )
+
+    # Return the meal plan along with adjusted macros and macro differences
+    response = {
+        "meal_plan": meal_plan,
+        "adjusted_macros_per_meal": adjusted_macros,
+        "macro_differences": macro_differences,
+        "seed": meal_selection["seed"],
+    }
+    structured_logging.log_payload(logger, "Generated meal plan", response)
+    return response
+
+
+def generate_meal_plan(user_input, meal_selection):
+    """Build the /generate_meal_plan response. ValueError means a bad request."""
+    load()
+    user = create_user(user_input)
+    if meal_selection["seed"] is None:
+        # Seeded so the same request gives the same plan
+        meal_selection = dict(
+            meal_selection,
+            seed=derive_seed(list(user_macros(user).values()), meal_selection),
+        )
+    meal_generator = create_meal_generator(user, meal_selection)
+    meal_plan = meal_generator.generate_full_plan(meal_selection["user_selected_items"])
+    return plan_response(user, meal_selection, meal_generator, meal_plan, user_input)
+
+
+def generate_quantized_plan(user_input, meal_selection, solutions=None):
+    """Build the /generate_meal_plan response from the plan of the user's target bucket.
+
+    The plan is solved for the quantized targets unless its solutions are given
+    (e.g. from a cache), then refined to the user's exact targets. Returns the
+    response, with a report of the precision lost, and the bucket's solutions.
+    """
+    load()
+    user = create_user(user_input)
+    exact = user_macros(user)
+    bucket = quantize_macros(exact)
+    user_selected_items = meal_selection["user_selected_items"]
+
+    if solutions is None:
+        bucket_generator = create_meal_generator(
+            create_bucket_user(user_input), meal_selection
+        )
+        bucket_generator.generate_full_plan(user_selected_items)
+        solutions = bucket_generator.solutions
+
+    meal_generator = create_meal_generator(user, meal_selection)
+    meal_plan = meal_generator.refine_plan(user_selected_items, solutions)
+    response = plan_response(
+        user, meal_selection, meal_generator, meal_plan, user_input
+    )
+    response["quantization"] = {
+        "bucket_targets": bucket,
+        # How far the bucket's targets are from the user's, before refinement
+        "target_rounding": {
+            nutrient: bucket[nutrient] - exact[nutrient] for nutrient in exact
+        },
+        "relative_rounding": {
+            nutrient: (bucket[nutrient] - exact[nutrient]) / exact[nutrient]
+            for nutrient in exact
+            if exact[nutrient]
+        },
+    }
+    return response, solutions
+
+
+def prepare_recommendations(recommendation_input):
+    """Return (engine, meal plan) for a /generate_recommendations request dict."""
+    load()
+
+    # Convert MealDetails and MealItem to a dictionary-like structure for the recommendation engine
+    meal_plan = {}
+    for meal_name, meal_details in recommendation_input["meal_plan"]["meals"].items():
+        meal_plan[meal_name] = {
+            "items": [
+                {
+                    "name": item["name"],
+                    "macros": {
+                        "calories": item["macros"]["calories"],
+                        "protein": item["macros"]["protein"],
+                        "carbs": item["macros"]["carbs"],
+                        "fats": item["macros"]["fats"],
+                    },
+                    # Include quantity in meal item, with a default if missing
+                    "quantity": item["quantity"] or "100 g",
+                }
+                for item in meal_details["items"]
+            ],
+            "macros": {
+                "calories": meal_details["macros"]["calories"],
+                "protein": meal_details["macros"]["protein"],
+                "carbs": meal_details["macros"]["carbs"],
+                "fats": meal_details["macros"]["fats"],
+            },
+        }
+
+    structured_logging.log_payload(
+        logger, "Transformed meal plan for recommendation engine", meal_plan
+    )
+
+    # Extract the target macros
+    target_macros = {
+        meal_name: {
+            "calories": target["calories"],
+            "protein": target["protein"],
+            "carbs": target["carbs"],
+            "fats": target["fats"],
+        }
+        for meal_name, target in recommendation_input["target_macros"].items()
+    }
+
+    logger.debug("Target macros: %s", target_macros)
+
+    # Initialize RecommendationEngine with the user's target macros for all meals
+    search = recommendation_input["search"]
+    engine = RecommendationEngine(
+        catalog.df,
+        {
+            "calories": sum(target["calories"] for target in target_macros.values()),
+            "protein": sum(target["protein"] for target in target_macros.values()),
+            "carbs": sum(target["carbs"] for target in target_macros.values()),
+            "fats": sum(target["fats"] for target in target_macros.values()),
+        },
+        index=alternative_index,
+        catalog=catalog,
+        macro_index=macro_index if search == "nearest" else None,
+        prune_by_nutrient=search == "nutrient",
+        top_within=recommendation_input["top_within"],
+        top_outside=recommendation_input["top_outside"],
+    )
+    return engine, meal_plan
+
+
+def generate_recommendations(recommendation_input):
+    """Build the /generate_recommendations response (a list, empty if nothing was recommended)."""
+    engine, meal_plan = prepare_recommendations(recommendation_input)
+    recommendations = engine.generate_recommendations_batch(meal_plan=meal_plan)
+    structured_logging.log_payload(logger, "Generated recommendations", recommendations)
+    return recommendations
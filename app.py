@@ -7,6 +7,7 @@ from recommendation_rulebase import (
     RecommendationEngine as RuleBasedRecommendationEngine,
 )
 from data_handler import DataHandler
+from food_catalog import get_catalog
 from user_input import get_user_input
 from visualization import create_macros_chart
 
@@ -134,9 +135,7 @@ def main():
                             deviation = alt["deviation"]
 
                             # Adjust quantity to match original food's calorie content
-                            alt_food_data = df_cleaned[
-                                df_cleaned["FOOD ITEM"] == alt_food_name
-                            ].iloc[0]
+                            alt_food_data = get_catalog(df_cleaned).get(alt_food_name)
 
                             # Calculate the new portion size to match the original food's calories
                             alt_nutrients = (
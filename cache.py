@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Cache backends share one interface: get(key, default), set(key, value), clear()
+# and stats(). LRUCache keeps entries in process; DiskCache keeps them on disk,
+# where other processes on the same machine can read them. A shared store (e.g.
+# Redis) only needs the same four methods to be used as a TieredCache backend.
+
+
+def cache_key(*parts):
+    """Return a canonical hash of the given JSON-serializable values."""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+class LRUCache:
+    """Bounded least-recently-used cache with hit/miss counters.
+
+    With ttl set, entries older than ttl seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key and mark it as recently used."""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            value, expires = self._data[key]
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entry when full."""
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return the cache size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class DiskCache:
+    """Cache of picklable values stored as one file per key in a directory."""
+
+    def __init__(self, directory, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        name = hashlib.sha256(str(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.pkl")
+
+    def get(self, key, default=None):
+        """Return the stored value for key, unless it is missing or older than ttl."""
+        path = self.path(key)
+        try:
+            if (
+                self.ttl is not None
+                and os.path.getmtime(path) + self.ttl <= time.time()
+            ):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as file:
+                stored_key, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        if stored_key != key:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store value under key, replacing the file atomically."""
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            pickle.dump((key, value), file)
+        os.replace(temp_path, self.path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return sum(name.endswith(".pkl") for name in os.listdir(self.directory))
+
+    def stats(self):
+        """Return the cache size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "directory": self.directory,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class TieredCache:
+    """In-process LRU cache in front of an optional slower backend (disk or shared store)."""
+
+    def __init__(self, maxsize=128, ttl=None, backend=None):
+        self.front = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value from the front cache, else from the backend (and keep it in front)."""
+        missing = object()
+        value = self.front.get(key, missing)
+        if value is missing and self.backend is not None:
+            value = self.backend.get(key, missing)
+            if value is not missing:
+                self.front.set(key, value)
+        if value is missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.front.set(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def clear(self):
+        self.front.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def __len__(self):
+        return len(self.front)
+
+    def stats(self):
+        """Return the overall hit/miss counters, with the stats of each tier."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "front": self.front.stats(),
+            "backend": self.backend.stats() if self.backend is not None else None,
+        }
@@ -0,0 +1,32 @@
+import os
+
+# Service configuration, overridable through environment variables (e.g. on Heroku)
+
+# Run the per-meal optimizations of a plan concurrently on a shared worker pool
+PARALLEL_MEALS = os.environ.get("PARALLEL_MEALS", "false").lower() == "true"
+# "thread" (the NumPy engine releases the GIL) or "process"
+MEAL_EXECUTOR = os.environ.get("MEAL_EXECUTOR", "thread")
+MEAL_POOL_SIZE = int(os.environ.get("MEAL_POOL_SIZE", "3"))
+# Worker processes for the island-model GA (one island per process at most);
+# ISLAND_EXECUTOR "thread" evolves the islands on threads instead
+ISLAND_EXECUTOR = os.environ.get("ISLAND_EXECUTOR", "process")
+ISLAND_POOL_SIZE = int(os.environ.get("ISLAND_POOL_SIZE", str(os.cpu_count() or 1)))
+# Worker pool for the CPU-heavy API request work: "process" (default) or "thread"
+REQUEST_EXECUTOR = os.environ.get("REQUEST_EXECUTOR", "process")
+REQUEST_POOL_SIZE = int(os.environ.get("REQUEST_POOL_SIZE", str(os.cpu_count() or 1)))
+# Requests allowed to run or wait on that pool before the API answers 503
+REQUEST_QUEUE_SIZE = int(
+    os.environ.get("REQUEST_QUEUE_SIZE", str(4 * REQUEST_POOL_SIZE))
+)
+# /generate_meal_plan response cache: in-process LRU entries and their lifetime
+# in seconds; set PLAN_CACHE_DIR to also keep plans on disk, shared by processes
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL = float(os.environ.get("PLAN_CACHE_TTL", "3600"))
+PLAN_CACHE_DIR = os.environ.get("PLAN_CACHE_DIR")
+# Logging: root level, per-module levels as "module=LEVEL,..." (e.g.
+# "recommendation_rulebase=DEBUG"), and "text" or "json" records
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Share of requests whose full payloads (plans, recommendations) are logged at DEBUG
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
@@ -0,0 +1,141 @@
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from cache import LRUCache
+
+# Columns exposed as float arrays; values that are not numbers become NaN
+NUMERIC_COLUMNS = [
+    "QUANTITY",
+    "PROTEIN",
+    "NET CARBS",
+    "DIETARY FIBRE",
+    "TOTAL SUGARS",
+    "FATS",
+    "CALORIES",
+]
+# Cluster labels from data/clustering.py, kept as integer arrays
+CLUSTER_COLUMNS = ["Cluster_Number", "Reverse_Cluster_Number"]
+
+# Columns hashed, with the names, into the catalog fingerprint
+FINGERPRINT_COLUMNS = [
+    "CALORIES",
+    "PROTEIN",
+    "NET CARBS",
+    "FATS",
+    "Reverse_Cluster_Number",
+]
+
+# Every catalog gets a new version, so caches keyed on it never mix catalogs
+_versions = itertools.count(1)
+
+
+class FoodCatalog:
+    """Food data loaded once, with O(1) lookups by FOOD ITEM name.
+
+    Duplicate names resolve to their first row, like df[df["FOOD ITEM"] == name].iloc[0].
+    The later rows of a duplicate name are shadowed: searches skip them (see
+    searchable), so results never repeat a name or rank a row the name does not
+    resolve to.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.version = next(_versions)
+        self.food_names = df["FOOD ITEM"].to_numpy()
+        self.arrays = {
+            column: np.ascontiguousarray(
+                pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+            )
+            for column in NUMERIC_COLUMNS
+            if column in df.columns
+        }
+        self.arrays.update(
+            {
+                column: df[column].to_numpy()
+                for column in CLUSTER_COLUMNS
+                if column in df.columns
+            }
+        )
+        self.records = df.to_dict("records")
+        self.positions = {}
+        for index, name in enumerate(self.food_names):
+            self.positions.setdefault(name, index)
+        # Rows a search may return: the first row of every name
+        self.searchable = np.zeros(len(self.food_names), dtype=bool)
+        self.searchable[list(self.positions.values())] = True
+        self.density_orders = {}
+        self._fingerprint = None
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        return cls(pd.read_csv(csv_path))
+
+    def fingerprint(self):
+        """Hash of the row count, names and FINGERPRINT_COLUMNS, stable across processes.
+
+        Data derived offline from a catalog stores it, to detect a changed CSV.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256(str(len(self.food_names)).encode())
+            for name in self.food_names:
+                digest.update(str(name).encode() + b"\0")
+            for column in FINGERPRINT_COLUMNS:
+                if column in self.df.columns:
+                    values = pd.to_numeric(self.df[column], errors="coerce")
+                    digest.update(values.to_numpy(dtype=float).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def index_of(self, name):
+        """Return the row index for a food name, or None if it is not in the catalog."""
+        return self.positions.get(name)
+
+    def get(self, name):
+        """Return the row for a food name as a dict (shared, do not modify), or None."""
+        index = self.positions.get(name)
+        return None if index is None else self.records[index]
+
+    def density(self, column):
+        """Return the column per 100 kcal for every row (NaN where calories are missing or zero)."""
+        calories = self.arrays["CALORIES"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            density = self.arrays[column] * 100 / calories
+        density[~(calories > 0) | ~np.isfinite(density)] = np.nan
+        return density
+
+    def density_order(self, column):
+        """Return (rows, densities): the searchable rows with a density for column, sorted by it ascending."""
+        if column not in self.density_orders:
+            density = self.density(column)
+            rows = np.flatnonzero(~np.isnan(density) & self.searchable)
+            rows = rows[np.argsort(density[rows], kind="stable")]
+            self.density_orders[column] = (rows, density[rows])
+        return self.density_orders[column]
+
+    def get_many(self, names):
+        """Return the rows for the names found in the catalog, in the given order."""
+        return [
+            self.records[self.positions[name]]
+            for name in names
+            if name in self.positions
+        ]
+
+
+# Catalogs for the DataFrames in use, so callers that only have a df share one
+_catalogs = LRUCache(maxsize=4)
+
+
+def get_catalog(df):
+    """Return the FoodCatalog for a DataFrame, building it on first use."""
+    catalog = _catalogs.get(id(df))
+    if catalog is None or catalog.df is not df:
+        catalog = FoodCatalog(df)
+        _catalogs.set(id(df), catalog)
+    return catalog
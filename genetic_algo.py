@@ -1,5 +1,11 @@
+import hashlib
+import heapq
+import json
 import random
 import math
+import time
+import numpy as np
+from scipy.optimize import lsq_linear
 
 # Genetic Algorithm Configuration
 POPULATION_SIZE = 100
@@ -7,14 +13,143 @@ GENERATIONS = 100
 TOURNAMENT_SIZE = 5
 CROSSOVER_RATE = 0.8
 MUTATION_RATE = 0.2
+ELITE_SIZE = 2  # best chromosomes carried over unchanged to the next generation
 MIN_PORTION = 0  # grams
 MAX_PORTION = 300  # grams
+MIN_COUNT = 1  # servings for non-base units
+MAX_COUNT = 20  # servings for non-base units
+
+# Nutrients optimized by the fitness function, in matrix column order
+NUTRIENTS = ["calories", "protein", "carbs", "fats"]
+# All nutrients tracked per gene; the first columns match NUTRIENTS
+FOOD_SET_NUTRIENTS = NUTRIENTS + ["sugars", "fiber"]
+
+# Prioritize protein for high-protein categories
+HIGH_PROTEIN_CATEGORIES = [
+    "BEEF",
+    "CHICKEN",
+    "EGGS",
+    "LAMB",
+    "PORK",
+    "BUFFALO",
+    "TUNA",
+    "FISH",
+    "MEAT",
+    "PROTEIN",
+    "MEAT SUBSTITUTES",
+    "POULTRY",
+    "CRUSTACEA AND MOLLUSCS",
+    "BEAN",
+    "CHEESE",
+]
+HIGH_PROTEIN_WEIGHT = 2
+
+# Least-squares fast path: accept the rounded solution when its fitness is within
+# this factor (plus an absolute slack) of the continuous optimum, otherwise run the GA
+FAST_PATH_TOLERANCE = 1.05
+FAST_PATH_SLACK = 1.0
+
+# Early stopping defaults (None disables the criterion)
+TARGET_FITNESS = None  # stop once the best fitness is at or below this value
+STALL_GENERATIONS = None  # stop after this many generations without improvement
+TIME_BUDGET_MS = None  # stop once this much wall-clock time has been spent
+
+
+def derive_seed(*parts):
+    """Derive a reproducible seed from a hash of the given JSON-serializable values."""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return int.from_bytes(hashlib.sha256(payload).digest()[:8], "big")
+
+
+class FoodSet:
+    """Compiled nutrient arrays for one selection of foods, shared by the solvers."""
+
+    def __init__(self, food_items):
+        self.food_items = food_items
+        self.names = tuple(food["name"] for food in food_items)
+        self.base_mask = np.array(
+            [food["unit_category"] == "Base Units" for food in food_items], dtype=bool
+        )
+        self.count_mask = ~self.base_mask
+        # Base Units genes are grams, so scale the nutrients down to one gram
+        scale = np.array(
+            [
+                1 / food["quantity"] if food["unit_category"] == "Base Units" else 1
+                for food in food_items
+            ]
+        )
+        # Nutrients contributed by one unit of each gene, in FOOD_SET_NUTRIENTS order
+        self.coefficients = np.ascontiguousarray(
+            np.array(
+                [[food.get(n, 0) for n in FOOD_SET_NUTRIENTS] for food in food_items],
+                dtype=float,
+            ).reshape(len(food_items), len(FOOD_SET_NUTRIENTS))
+            * scale[:, None]
+        )
+        self.nutrient_matrix = np.ascontiguousarray(
+            self.coefficients[:, : len(NUTRIENTS)]
+        )
+        self.lower = np.where(self.base_mask, MIN_PORTION, MIN_COUNT).astype(float)
+        self.upper = np.where(self.base_mask, MAX_PORTION, MAX_COUNT).astype(float)
+        self.protein_weight = 1
+        if any(food["category"] in HIGH_PROTEIN_CATEGORIES for food in food_items):
+            self.protein_weight = HIGH_PROTEIN_WEIGHT
+
+    def __len__(self):
+        return len(self.food_items)
+
+    def reorder(self, names):
+        """Return the food set with its foods in the order of names (missing names are skipped)."""
+        positions = {}
+        for index, name in enumerate(self.names):
+            positions.setdefault(name, []).append(index)
+        order = [positions[name].pop(0) for name in names if positions.get(name)]
+        if order == list(range(len(self.names))):
+            return self
+        return FoodSet([self.food_items[i] for i in order])
+
+    def nutrients(self, solution):
+        """Per-food nutrient totals for a solution, one row per food."""
+        return np.asarray(solution, dtype=float)[:, None] * self.coefficients
 
 
 class GeneticAlgorithm:
-    def __init__(self, food_items, target_nutrients):
+    def __init__(
+        self,
+        food_items,
+        target_nutrients,
+        vectorized=False,
+        food_set=None,
+        fast_path=False,
+        target_fitness=TARGET_FITNESS,
+        stall_generations=STALL_GENERATIONS,
+        time_budget_ms=TIME_BUDGET_MS,
+        seed=None,
+    ):
         self.food_items = food_items
         self.target_nutrients = target_nutrients
+        # Use the NumPy population engine instead of lists of Python lists
+        self.vectorized = vectorized
+        # Try the bounded least-squares solution before evolving a population
+        self.fast_path = fast_path
+        # Stopping criteria; run() records why it stopped in stop_reason
+        self.target_fitness = target_fitness
+        self.stall_generations = stall_generations
+        self.time_budget_ms = time_budget_ms
+        self.stop_reason = None
+        self._start_time = None
+        # Each instance owns its random streams, so the same seed gives the same
+        # result and concurrent runs in one process do not share RNG state
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.food_set = food_set if food_set is not None else FoodSet(food_items)
+        self.base_mask = self.food_set.base_mask
+        self.nutrient_matrix = self.food_set.nutrient_matrix
+        self.target_vector = np.array(
+            [target_nutrients[n] for n in NUTRIENTS], dtype=float
+        )
+        self.weights = np.array([1, self.food_set.protein_weight, 1, 1], dtype=float)
 
     def initialize_population(self):
         population = []
@@ -22,9 +157,11 @@ class GeneticAlgorithm:
             chromosome = []
             for food in self.food_items:
                 if food["unit_category"] == "Base Units":
-                    qty = random.uniform(1, 300)  # Quantities for Base Units
+                    qty = self.random.uniform(1, 300)  # Quantities for Base Units
                 else:
-                    qty = random.randint(1, 20)  # Integer quantities for other units
+                    qty = self.random.randint(
+                        1, 20
+                    )  # Integer quantities for other units
                 chromosome.append(qty)
             population.append(chromosome)
         return population
@@ -54,69 +191,23 @@ class GeneticAlgorithm:
     #     return math.sqrt(total_deviation)  # Lower is better
 
     def fitness(self, chromosome):
-        total_calories = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fats = 0
-        for gene, food in zip(chromosome, self.food_items):
-            if food["unit_category"] == "Base Units":
-                factor = gene / food["quantity"]
-            else:
-                factor = gene
-
-            total_calories += food["calories"] * factor
-            total_protein += food["protein"] * factor
-            total_carbs += food["carbs"] * factor
-            total_fats += food["fats"] * factor
-
-        # Calculate squared deviations
-        calorie_dev = (total_calories - self.target_nutrients["calories"]) ** 2
-        protein_dev = (total_protein - self.target_nutrients["protein"]) ** 2
-        carbs_dev = (total_carbs - self.target_nutrients["carbs"]) ** 2
-        fats_dev = (total_fats - self.target_nutrients["fats"]) ** 2
-
-        # Prioritize protein for high-protein categories
-        high_protein_categories = [
-            "BEEF",
-            "CHICKEN",
-            "EGGS",
-            "LAMB",
-            "PORK",
-            "BUFFALO",
-            "TUNA",
-            "FISH",
-            "MEAT",
-            "PROTEIN",
-            "MEAT SUBSTITUTES",
-            "POULTRY",
-            "CRUSTACEA AND MOLLUSCS",
-            "BEAN",
-            "CHEESE",
-        ]
-
-        protein_weight = 1
-        if any(food["category"] in high_protein_categories for food in self.food_items):
-            protein_weight = (
-                2  # Increase the weight for protein deviation in these categories
-            )
-
-        # Sum of squared deviations with adjusted weight for protein
-        total_deviation = (
-            calorie_dev + (protein_dev * protein_weight) + carbs_dev + fats_dev
-        )
-        return math.sqrt(total_deviation)
+        # Squared deviations per nutrient, with the protein weight applied
+        # for high-protein categories (see FoodSet.protein_weight)
+        deviations = np.dot(chromosome, self.nutrient_matrix) - self.target_vector
+        return math.sqrt(np.dot(deviations**2, self.weights))
 
     def tournament_selection(self, population, scores):
+        """Return the population indices of the tournament winners."""
         selected = []
         for _ in range(POPULATION_SIZE):
-            tournament = random.sample(list(zip(population, scores)), TOURNAMENT_SIZE)
-            tournament.sort(key=lambda x: x[1])  # Sort by fitness (lower is better)
-            selected.append(tournament[0][0])
+            tournament = self.random.sample(range(len(population)), TOURNAMENT_SIZE)
+            # Lower fitness is better
+            selected.append(min(tournament, key=scores.__getitem__))
         return selected
 
     def crossover(self, parent1, parent2):
-        if random.random() < CROSSOVER_RATE:
-            point = random.randint(1, len(parent1) - 1)
+        if self.random.random() < CROSSOVER_RATE:
+            point = self.random.randint(1, len(parent1) - 1)
             child1 = parent1[:point] + parent2[point:]
             child2 = parent2[:point] + parent1[point:]
             return child1, child2
@@ -125,57 +216,274 @@ class GeneticAlgorithm:
 
     def mutate(self, chromosome):
         for i in range(len(chromosome)):
-            if random.random() < MUTATION_RATE:
-                mutation_factor = random.uniform(0.98, 1.02)
+            if self.random.random() < MUTATION_RATE:
+                mutation_factor = self.random.uniform(0.98, 1.02)
                 if self.food_items[i]["unit_category"] == "Base Units":
                     new_qty = chromosome[i] * mutation_factor
                     new_qty = max(MIN_PORTION, min(new_qty, MAX_PORTION))
                 else:
-                    new_qty = chromosome[i] + random.choice(
+                    new_qty = chromosome[i] + self.random.choice(
                         [-1, 1]
                     )  # Mutate by adding or subtracting 1
                     new_qty = max(
-                        1, min(new_qty, 20)
+                        MIN_COUNT, min(new_qty, MAX_COUNT)
                     )  # Keep within reasonable range for non-base units
                 chromosome[i] = new_qty
         return chromosome
 
     def run(self):
-        population = self.initialize_population()
-        for generation in range(GENERATIONS):
+        self._start_time = time.perf_counter()
+        if self.fast_path:
+            solution, score, relaxed_score = self.solve_least_squares()
+            if score <= relaxed_score * FAST_PATH_TOLERANCE + FAST_PATH_SLACK:
+                self.stop_reason = "least_squares"
+                return self.to_chromosome(solution), score
+            # The integer genes make the rounded answer poor: fall back to the GA
+            best_chromosome, best_score = self.evolve()
+            if score < best_score:
+                # The GA ran but did not beat the least-squares answer
+                self.stop_reason = "least_squares"
+                return self.to_chromosome(solution), score
+            return best_chromosome, best_score
+        return self.evolve()
+
+    def should_stop(self, generation, best_score):
+        """Check the stopping criteria after scoring a generation, setting stop_reason."""
+        if best_score < self._best_seen:
+            self._best_seen = best_score
+            self._last_improvement = generation
+        if self.target_fitness is not None and best_score <= self.target_fitness:
+            self.stop_reason = "target_fitness"
+        elif (
+            self.stall_generations is not None
+            and generation - self._last_improvement >= self.stall_generations
+        ):
+            self.stop_reason = "stalled"
+        elif (
+            self.time_budget_ms is not None
+            and (time.perf_counter() - self._start_time) * 1000 >= self.time_budget_ms
+        ):
+            self.stop_reason = "time_budget"
+        return self.stop_reason is not None
+
+    def evolve(self):
+        """Run the genetic algorithm and return the best chromosome and its fitness."""
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        self._best_seen = math.inf
+        self._last_improvement = 0
+        self.stop_reason = None
+        if self.vectorized:
+            population = self.initialize_population_array()
+            scores = self.fitness_array(population)
+            breed = self.next_generation_array
+        else:
+            population = self.initialize_population()
             scores = [self.fitness(chrom) for chrom in population]
-            selected = self.tournament_selection(population, scores)
-            next_generation = []
-            for i in range(0, POPULATION_SIZE, 2):
-                parent1 = selected[i]
-                parent2 = selected[i + 1] if i + 1 < POPULATION_SIZE else selected[0]
-                child1, child2 = self.crossover(parent1, parent2)
-                next_generation.extend([self.mutate(child1), self.mutate(child2)])
-            population = next_generation[:POPULATION_SIZE]
-            if (generation + 1) % 10 == 0 or generation == 0:
-                best_score = min(scores)
-                avg_score = sum(scores) / len(scores)
-                # print(
-                #     f"Generation {generation+1}: Best Fitness = {best_score:.4f}, Avg Fitness = {avg_score:.4f}"
-                # )
-        final_scores = [self.fitness(chrom) for chrom in population]
-        best_index = final_scores.index(min(final_scores))
-        best_chromosome = population[best_index]
-        return best_chromosome, final_scores[best_index]
+            breed = self.next_generation
+
+        # Keep a running best so the final population needs no extra scoring pass
+        best_index = int(np.argmin(scores))
+        best_chromosome = list(population[best_index])
+        best_score = float(scores[best_index])
+        for generation in range(GENERATIONS):
+            if self.should_stop(generation, best_score):
+                break
+            population, scores = breed(population, scores)
+            best_index = int(np.argmin(scores))
+            if scores[best_index] < best_score:
+                best_chromosome = list(population[best_index])
+                best_score = float(scores[best_index])
+        else:
+            self.stop_reason = "generations"
+
+        if self.vectorized:
+            best_chromosome = self.to_chromosome(best_chromosome)
+        return best_chromosome, best_score
+
+    def next_generation(self, population, scores):
+        """Breed the next population and its scores, carrying the elite over unchanged."""
+        elite = heapq.nsmallest(
+            ELITE_SIZE, range(len(population)), key=scores.__getitem__
+        )
+        selected = self.tournament_selection(population, scores)
+        children = []
+        for i in range(0, POPULATION_SIZE, 2):
+            parent1 = population[selected[i]]
+            parent2 = (
+                population[selected[i + 1]]
+                if i + 1 < POPULATION_SIZE
+                else population[selected[0]]
+            )
+            child1, child2 = self.crossover(parent1, parent2)
+            children.extend([self.mutate(child1), self.mutate(child2)])
+
+        next_population = [population[i] for i in elite]
+        next_scores = [scores[i] for i in elite]
+        for child, parent in zip(children[: POPULATION_SIZE - len(elite)], selected):
+            next_population.append(child)
+            # Chromosomes that passed crossover and mutation unchanged keep their score
+            next_scores.append(
+                scores[parent] if child == population[parent] else self.fitness(child)
+            )
+        return next_population, next_scores
 
     def calculate_nutrients(self, chromosome):
-        total_calories = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fats = 0
-        for gene, food in zip(chromosome, self.food_items):
-            if food["unit_category"] == "Base Units":
-                factor = gene / food["quantity"]  # Use actual quantity from data
-            else:
-                factor = gene  # For non-base units, gene itself is the multiplier
-
-            total_calories += food["calories"] * factor
-            total_protein += food["protein"] * factor
-            total_carbs += food["carbs"] * factor
-            total_fats += food["fats"] * factor
+        total_calories, total_protein, total_carbs, total_fats = (
+            float(total) for total in np.dot(chromosome, self.nutrient_matrix)
+        )
         return total_calories, total_protein, total_carbs, total_fats
+
+    # Vectorized engine: the population is a (POPULATION_SIZE x n_foods) array
+
+    def initialize_population_array(self):
+        """Create the initial population as a 2D array, one chromosome per row."""
+        shape = (POPULATION_SIZE, len(self.food_items))
+        base_qty = self.rng.uniform(1, 300, shape)
+        count_qty = self.rng.integers(MIN_COUNT, MAX_COUNT + 1, shape).astype(float)
+        return np.where(self.base_mask, base_qty, count_qty)
+
+    def fitness_array(self, population):
+        """Score every chromosome of the population at once (lower is better)."""
+        deviations = population @ self.nutrient_matrix - self.target_vector
+        return np.sqrt((deviations**2) @ self.weights)
+
+    def tournament_selection_array(self, population, scores):
+        """Return the population indices of the tournament winners."""
+        # Draw TOURNAMENT_SIZE distinct contestants per slot, like random.sample
+        contestants = np.argpartition(
+            self.rng.random((POPULATION_SIZE, len(population))),
+            TOURNAMENT_SIZE - 1,
+            axis=1,
+        )[:, :TOURNAMENT_SIZE]
+        return contestants[
+            np.arange(POPULATION_SIZE), np.argmin(scores[contestants], axis=1)
+        ]
+
+    def crossover_array(self, selected):
+        """One-point crossover of consecutive pairs, returning the interleaved children."""
+        parents1 = selected[0::2]
+        parents2 = selected[1::2]
+        if len(parents2) < len(parents1):
+            # Odd population: the last parent is paired with the first one
+            parents2 = np.vstack([parents2, selected[:1]])
+        n_pairs, n_genes = parents1.shape
+        if n_genes > 1:
+            crossed = self.rng.random(n_pairs) < CROSSOVER_RATE
+            points = self.rng.integers(1, n_genes, n_pairs)
+            swap = (np.arange(n_genes) >= points[:, None]) & crossed[:, None]
+        else:
+            swap = np.zeros((n_pairs, n_genes), dtype=bool)
+        children = np.empty((2 * n_pairs, n_genes))
+        children[0::2] = np.where(swap, parents2, parents1)
+        children[1::2] = np.where(swap, parents1, parents2)
+        return children[:POPULATION_SIZE]
+
+    def mutate_array(self, population):
+        mutated = self.rng.random(population.shape) < MUTATION_RATE
+        base_qty = np.clip(
+            population * self.rng.uniform(0.98, 1.02, population.shape),
+            MIN_PORTION,
+            MAX_PORTION,
+        )
+        count_qty = np.clip(
+            population + self.rng.choice([-1, 1], population.shape),
+            MIN_COUNT,
+            MAX_COUNT,
+        )
+        return np.where(
+            mutated, np.where(self.base_mask, base_qty, count_qty), population
+        )
+
+    def next_generation_array(self, population, scores):
+        """Breed the next population and its scores, carrying the elite over unchanged."""
+        elite = np.argsort(scores, kind="stable")[:ELITE_SIZE]
+        selected = self.tournament_selection_array(population, scores)
+        parents = population[selected]
+        children = self.mutate_array(self.crossover_array(parents))
+        children = children[: POPULATION_SIZE - len(elite)]
+
+        # Chromosomes that passed crossover and mutation unchanged keep their score
+        child_scores = scores[selected[: len(children)]]
+        changed = (children != parents[: len(children)]).any(axis=1)
+        child_scores[changed] = self.fitness_array(children[changed])
+        return (
+            np.vstack([population[elite], children]),
+            np.concatenate([scores[elite], child_scores]),
+        )
+
+    def to_chromosome(self, genes):
+        """Convert an array row back to the list chromosome returned by run()."""
+        return [
+            float(gene) if is_base else int(round(gene))
+            for gene, is_base in zip(genes, self.base_mask)
+        ]
+
+    # Least-squares fast path: the weighted squared deviation is a bounded linear
+    # least-squares problem, so it can be solved directly for small meals
+
+    def solve_least_squares(self):
+        """Solve the bounded least-squares relaxation, then round and repair the count genes.
+
+        Returns the repaired solution, its fitness and the fitness of the continuous
+        optimum, which is a lower bound for any solution.
+        """
+        food_set = self.food_set
+        relaxed = self._least_squares(
+            np.zeros(len(food_set)), np.ones(len(food_set), dtype=bool)
+        )
+        relaxed_score = self.fitness(relaxed)
+        if not food_set.count_mask.any():
+            return relaxed, relaxed_score, relaxed_score
+
+        solution = relaxed.copy()
+        solution[food_set.count_mask] = np.round(solution[food_set.count_mask])
+        solution = self._least_squares(solution, food_set.base_mask)
+        score = self.fitness(solution)
+
+        # Repair: move count genes by one serving while that improves the fitness
+        improved = True
+        while improved:
+            improved = False
+            for i in np.flatnonzero(food_set.count_mask):
+                for step in (-1, 1):
+                    candidate = solution.copy()
+                    candidate[i] += step
+                    if not food_set.lower[i] <= candidate[i] <= food_set.upper[i]:
+                        continue
+                    candidate = self._least_squares(candidate, food_set.base_mask)
+                    candidate_score = self.fitness(candidate)
+                    if candidate_score < score:
+                        solution, score, improved = candidate, candidate_score, True
+        return solution, score, relaxed_score
+
+    def refine(self, solution):
+        """Re-solve the gram portions of a solution for this GA's targets, keeping its servings.
+
+        A cheap local step for a solution found for nearby targets; returns the better
+        of the refined and the given solution as a chromosome like run(), with its
+        fitness.
+        """
+        solution = np.asarray(solution, dtype=float)
+        score = self.fitness(solution)
+        refined = self._least_squares(solution, self.food_set.base_mask)
+        refined_score = self.fitness(refined)
+        if refined_score < score:
+            solution, score = refined, refined_score
+        return self.to_chromosome(solution), score
+
+    def _least_squares(self, solution, free_mask):
+        """Re-solve the genes in free_mask by bounded least squares, keeping the others fixed."""
+        if not free_mask.any():
+            return solution
+        scale = np.sqrt(self.weights)
+        fixed = np.dot(solution[~free_mask], self.nutrient_matrix[~free_mask])
+        result = lsq_linear(
+            (self.nutrient_matrix[free_mask] * scale).T,
+            (self.target_vector - fixed) * scale,
+            bounds=(self.food_set.lower[free_mask], self.food_set.upper[free_mask]),
+            method="bvls",
+        )
+        solution = solution.copy()
+        solution[free_mask] = result.x
+        return solution
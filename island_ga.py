@@ -0,0 +1,217 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import config
+from genetic_algo import GENERATIONS, FoodSet, GeneticAlgorithm
+
+# Island model configuration
+ISLANDS = 4  # sub-populations evolved on separate processes
+MIGRATION_INTERVAL = 10  # generations between migrations
+MIGRANTS = 2  # best chromosomes sent to the next island on each migration
+
+# Process pool shared by every IslandGeneticAlgorithm, created on first use
+_island_executor = None
+_island_executor_lock = threading.Lock()
+
+
+def get_island_executor():
+    """Return the shared pool the islands are evolved on, sized from config."""
+    global _island_executor
+    with _island_executor_lock:
+        if _island_executor is None:
+            if config.ISLAND_EXECUTOR == "process":
+                _island_executor = ProcessPoolExecutor(
+                    max_workers=config.ISLAND_POOL_SIZE
+                )
+            else:
+                _island_executor = ThreadPoolExecutor(
+                    max_workers=config.ISLAND_POOL_SIZE
+                )
+    return _island_executor
+
+
+def shutdown_island_executor():
+    """Shut down the shared island pool, if it was created."""
+    global _island_executor
+    with _island_executor_lock:
+        executor, _island_executor = _island_executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def _forget_island_executor():
+    """Drop the island pool inherited by a forked child: its workers and threads
+    belong to the parent, so the child creates its own pool on first use."""
+    global _island_executor, _island_executor_lock
+    _island_executor = None
+    _island_executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_island_executor)
+
+
+def evolve_island(
+    food_set,
+    target_nutrients,
+    population,
+    scores,
+    generations,
+    seed,
+    time_budget_ms=None,
+):
+    """Evolve one island for a number of generations (runs in a worker process).
+
+    Stops early once time_budget_ms has been spent.
+    """
+    start_time = time.perf_counter()
+    ga = GeneticAlgorithm(
+        food_set.food_items,
+        target_nutrients,
+        vectorized=True,
+        food_set=food_set,
+        seed=seed,
+    )
+    if population is None:
+        population = ga.initialize_population_array()
+        scores = ga.fitness_array(population)
+    for _ in range(generations):
+        if (
+            time_budget_ms is not None
+            and (time.perf_counter() - start_time) * 1000 >= time_budget_ms
+        ):
+            break
+        population, scores = ga.next_generation_array(population, scores)
+    return population, scores
+
+
+class IslandGeneticAlgorithm:
+    """Island-model GA: several populations evolve in parallel and exchange their best chromosomes.
+
+    Takes the same food_items/target_nutrients as GeneticAlgorithm and returns the
+    same (best_solution, fitness) tuple from run(). A seed makes runs reproducible.
+    The GA stopping criteria are checked after every migration interval, and
+    run() records why it stopped in stop_reason.
+    """
+
+    def __init__(
+        self,
+        food_items,
+        target_nutrients,
+        food_set=None,
+        islands=ISLANDS,
+        migration_interval=MIGRATION_INTERVAL,
+        migrants=MIGRANTS,
+        seed=None,
+        executor=None,
+        target_fitness=None,
+        stall_generations=None,
+        time_budget_ms=None,
+    ):
+        self.food_items = food_items
+        self.target_nutrients = target_nutrients
+        self.food_set = food_set if food_set is not None else FoodSet(food_items)
+        self.islands = islands
+        self.migration_interval = migration_interval
+        self.migrants = migrants
+        self.seed = seed
+        self.executor = executor
+        self.target_fitness = target_fitness
+        self.stall_generations = stall_generations
+        self.time_budget_ms = time_budget_ms
+        self.stop_reason = None
+
+    def migrate(self, populations, scores):
+        """Ring migration: the best of each island replace the worst of the next one."""
+        emigrants = [
+            np.argsort(island_scores, kind="stable")[: self.migrants]
+            for island_scores in scores
+        ]
+        incoming = [
+            (populations[i][emigrants[i]], scores[i][emigrants[i]])
+            for i in range(self.islands)
+        ]
+        for i in range(self.islands):
+            source_population, source_scores = incoming[i - 1]
+            worst = np.argsort(scores[i], kind="stable")[-self.migrants :]
+            populations[i][worst] = source_population
+            scores[i][worst] = source_scores
+
+    def remaining_ms(self, start_time):
+        """What is left of time_budget_ms (None when there is no budget)."""
+        if self.time_budget_ms is None:
+            return None
+        return max(self.time_budget_ms - (time.perf_counter() - start_time) * 1000, 0)
+
+    def should_stop(self, generation, best_score, start_time):
+        """Check the stopping criteria after an epoch, setting stop_reason."""
+        if best_score < self._best_seen:
+            self._best_seen = best_score
+            self._last_improvement = generation
+        if self.target_fitness is not None and best_score <= self.target_fitness:
+            self.stop_reason = "target_fitness"
+        elif (
+            self.stall_generations is not None
+            and generation - self._last_improvement >= self.stall_generations
+        ):
+            self.stop_reason = "stalled"
+        elif self.remaining_ms(start_time) == 0:
+            self.stop_reason = "time_budget"
+        return self.stop_reason is not None
+
+    def run(self):
+        start_time = time.perf_counter()
+        executor = self.executor or get_island_executor()
+        self._best_seen = math.inf
+        self._last_improvement = 0
+        self.stop_reason = None
+        # Every (epoch, island) task gets its own seed, so results do not depend on
+        # which worker process picks up which task
+        seeds = np.random.default_rng(self.seed).integers(
+            2**32, size=(math.ceil(GENERATIONS / self.migration_interval), self.islands)
+        )
+        populations = [None] * self.islands
+        scores = [None] * self.islands
+        generations_left = GENERATIONS
+        for epoch_seeds in seeds:
+            generations = min(self.migration_interval, generations_left)
+            futures = [
+                executor.submit(
+                    evolve_island,
+                    self.food_set,
+                    self.target_nutrients,
+                    populations[i],
+                    scores[i],
+                    generations,
+                    int(epoch_seeds[i]),
+                    self.remaining_ms(start_time),
+                )
+                for i in range(self.islands)
+            ]
+            populations, scores = map(list, zip(*(f.result() for f in futures)))
+            generations_left -= generations
+            best_score = min(float(island_scores.min()) for island_scores in scores)
+            if self.should_stop(GENERATIONS - generations_left, best_score, start_time):
+                break
+            if generations_left > 0 and self.islands > 1 and self.migrants > 0:
+                self.migrate(populations, scores)
+        else:
+            self.stop_reason = "generations"
+
+        best_island = min(range(self.islands), key=lambda i: scores[i].min())
+        best_index = int(np.argmin(scores[best_island]))
+        best_chromosome = [
+            float(gene) if is_base else int(round(gene))
+            for gene, is_base in zip(
+                populations[best_island][best_index], self.food_set.base_mask
+            )
+        ]
+        return best_chromosome, float(scores[best_island][best_index])
+
+    def calculate_nutrients(self, chromosome):
+        total_calories, total_protein, total_carbs, total_fats = (
+            float(total) for total in np.dot(chromosome, self.food_set.nutrient_matrix)
+        )
+        return total_calories, total_protein, total_carbs, total_fats
@@ -0,0 +1,160 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from ranking import TOP_OUTSIDE_CLUSTER, TOP_WITHIN_CLUSTER
+
+# Macro-space features: catalog column per nutrient, taken per 100 kcal
+MACRO_FEATURES = {"protein": "PROTEIN", "carbs": "NET CARBS", "fats": "FATS"}
+OPTIONAL_FEATURES = {"fiber": "DIETARY FIBRE", "sugars": "TOTAL SUGARS"}
+# Default search direction for each critical nutrient, as signed feature weights
+NUTRIENT_DIRECTIONS = {
+    "protein": {"protein": 1, "fats": -1},
+    "carbs": {"carbs": -1},
+    "fats": {"fats": -1},
+}
+# Distance moved along a direction, in standard deviations of the features
+DIRECTION_STEP = 1.0
+
+
+def nutrient_direction(nutrient_priority, direction=None):
+    """Feature weights to move along for a critical nutrient.
+
+    direction is 1 when the plan falls short of the nutrient, -1 when it exceeds it
+    and 0 when it is on target (no move); None uses NUTRIENT_DIRECTIONS. A direction
+    against the default moves along the nutrient alone.
+    """
+    default = NUTRIENT_DIRECTIONS.get(nutrient_priority)
+    if default is None or direction is None:
+        return default
+    if not direction:
+        return None
+    if direction == default[nutrient_priority]:
+        return default
+    return {nutrient_priority: direction}
+
+
+class MacroIndex:
+    """Nearest-neighbour index over the macro profile of every food.
+
+    Each food is a point of protein, carbs and fats (optionally fiber and sugars)
+    per 100 kcal, standardized so every feature counts the same. Queries run on a
+    KD-tree, so they are logarithmic in the catalog size. Cluster and category
+    filters get their own tree, built on first use. Foods without calories, and
+    the shadowed rows of duplicate names, are left out.
+    """
+
+    def __init__(self, catalog, features=None):
+        self.catalog = catalog
+        self.features = dict(MACRO_FEATURES)
+        for name in features or []:
+            if name not in OPTIONAL_FEATURES:
+                raise ValueError(f"Unknown macro feature: {name}")
+            self.features[name] = OPTIONAL_FEATURES[name]
+
+        calories = catalog.arrays["CALORIES"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_100_kcal = (
+                np.column_stack(
+                    [catalog.arrays[column] * 100 for column in self.features.values()]
+                )
+                / calories[:, None]
+            )
+        valid = (
+            (calories > 0) & np.isfinite(per_100_kcal).all(axis=1) & catalog.searchable
+        )
+        self.rows = np.flatnonzero(valid)
+
+        self.mean = per_100_kcal[valid].mean(axis=0)
+        self.scale = per_100_kcal[valid].std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.points = (per_100_kcal - self.mean) / self.scale
+        self.points[~valid] = np.nan
+
+        self.categories = catalog.df["CATEGORY"].to_numpy()
+        self.reverse_clusters = catalog.arrays["Reverse_Cluster_Number"]
+        self.trees = {}
+
+    def tree(self, cluster=None, category=None):
+        """Return the (tree, rows) for the foods matching the filters, building it on first use."""
+        key = (cluster, category)
+        if key not in self.trees:
+            rows = self.rows
+            if cluster is not None:
+                rows = rows[self.reverse_clusters[rows] == cluster]
+            if category is not None:
+                rows = rows[self.categories[rows] == category]
+            self.trees[key] = (cKDTree(self.points[rows]) if len(rows) else None, rows)
+        return self.trees[key]
+
+    def query_point(self, target_index, direction=None, step=DIRECTION_STEP):
+        """The target's point, moved step standard deviations along a direction like {"protein": 1, "fats": -1}."""
+        point = self.points[target_index].copy()
+        if direction:
+            offset = np.array(
+                [direction.get(name, 0) for name in self.features], dtype=float
+            )
+            norm = np.linalg.norm(offset)
+            if norm:
+                point += step * offset / norm
+        return point
+
+    def search(
+        self,
+        food_name,
+        k=5,
+        cluster=None,
+        category=None,
+        exclude_cluster=None,
+        direction=None,
+        step=DIRECTION_STEP,
+    ):
+        """Return [(alternative, distance)] for the k nearest foods, closest first."""
+        target_index = self.catalog.index_of(food_name)
+        if target_index is None:
+            raise ValueError(f"Food item {food_name} not found.")
+        if np.isnan(self.points[target_index]).any():
+            return []
+        tree, rows = self.tree(cluster, category)
+        if tree is None or k <= 0:
+            return []
+
+        point = self.query_point(target_index, direction, step)
+        # Over-fetch for the rows the filters drop, and widen until k are left
+        fetch = k + 1
+        while True:
+            fetch = min(fetch, len(rows))
+            distances, positions = tree.query(point, k=fetch)
+            distances, positions = np.atleast_1d(distances), np.atleast_1d(positions)
+            indices = rows[positions]
+            keep = self.catalog.food_names[indices] != food_name
+            if exclude_cluster is not None:
+                keep &= self.reverse_clusters[indices] != exclude_cluster
+            if keep.sum() >= k or fetch == len(rows):
+                break
+            fetch *= 4
+
+        indices, distances = indices[keep][:k], distances[keep][:k]
+        return list(zip(self.catalog.food_names[indices], distances))
+
+    def alternatives(
+        self,
+        food_name,
+        nutrient_priority=None,
+        top_within=TOP_WITHIN_CLUSTER,
+        top_outside=TOP_OUTSIDE_CLUSTER,
+        direction=None,
+    ):
+        """Nearest alternatives in the food's reverse cluster first, then from other clusters.
+
+        The query moves along the nutrient's direction (see nutrient_direction) when
+        there is one; direction is the plan's signed need for the nutrient.
+        """
+        target_index = self.catalog.index_of(food_name)
+        if target_index is None:
+            raise ValueError(f"Food item {food_name} not found.")
+        cluster = self.reverse_clusters[target_index]
+        direction = nutrient_direction(nutrient_priority, direction)
+        return self.search(
+            food_name, top_within, cluster=cluster, direction=direction
+        ) + self.search(
+            food_name, top_outside, exclude_cluster=cluster, direction=direction
+        )
@@ -1,20 +1,148 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from meal_generator import MealGenerator
-from recommendation_rulebase import (
-    RecommendationEngine as RuleBasedRecommendationEngine,
-)
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from ranking import MAX_ALTERNATIVES, TOP_OUTSIDE_CLUSTER, TOP_WITHIN_CLUSTER
+from cache import DiskCache, TieredCache, cache_key
+from genetic_algo import derive_seed
+from meal_generator import SOLVER_VERSION, MealGenerator, quantize_macros
 from user import User
-import pandas as pd
+import api_workers
+import config
+import json
 import logging
+import structured_logging
+
+# Configure logging (levels and format from config)
+structured_logging.configure()
+logger = logging.getLogger(__name__)
+
+# Load your food data (also preloaded into every request worker)
+FOOD_DATA_PATH = api_workers.FOOD_DATA_PATH
+api_workers.load(FOOD_DATA_PATH)
+catalog = api_workers.catalog
+
+_request_executor = None
+_request_executor_lock = threading.Lock()
+# Requests running or queued on the request pool (only touched on the event loop)
+_pending_requests = 0
+
+# Generated plans, keyed by a canonical hash of everything a plan depends on
+plan_cache = TieredCache(
+    maxsize=config.PLAN_CACHE_SIZE,
+    ttl=config.PLAN_CACHE_TTL,
+    backend=(
+        DiskCache(config.PLAN_CACHE_DIR, ttl=config.PLAN_CACHE_TTL)
+        if config.PLAN_CACHE_DIR
+        else None
+    ),
+)
+# Request options that change the generated plan
+PLAN_OPTIONS = [
+    "solver",
+    "target_fitness",
+    "stall_generations",
+    "time_budget_ms",
+    "joint",
+]
+
+
+def get_request_executor():
+    """Return the bounded pool the CPU-heavy request work runs on, sized from config."""
+    global _request_executor
+    with _request_executor_lock:
+        if _request_executor is None:
+            if config.REQUEST_EXECUTOR == "process":
+                _request_executor = ProcessPoolExecutor(
+                    max_workers=config.REQUEST_POOL_SIZE,
+                    initializer=api_workers.init_worker,
+                    initargs=(FOOD_DATA_PATH,),
+                )
+            else:
+                _request_executor = ThreadPoolExecutor(
+                    max_workers=config.REQUEST_POOL_SIZE
+                )
+    return _request_executor
+
+
+def check_capacity(slots=1):
+    """Answer 503 (retry later) when the request pool's queue has no room for slots more tasks."""
+    if _pending_requests + slots > config.REQUEST_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, retry later.",
+            headers={"Retry-After": "1"},
+        )
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 
-# Load your food data
-df = pd.read_csv("updated_food_data_with_complete_clusters.csv")
+async def offload(function, *args):
+    """Run request work on the request pool, answering 503 when its queue is full."""
+    global _pending_requests
+    check_capacity()
+    _pending_requests += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            get_request_executor(),
+            structured_logging.run_in_request,
+            structured_logging.request_context(),
+            function,
+            *args,
+        )
+    finally:
+        _pending_requests -= 1
+
+
+class ReservedStreamingResponse(StreamingResponse):
+    """StreamingResponse holding slots of the request pool's queue, released once
+    the response is sent (or fails, e.g. when the client disconnects)."""
+
+    def __init__(self, content, slots, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slots = slots
+
+    async def __call__(self, scope, receive, send):
+        global _pending_requests
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _pending_requests -= self.slots
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start every worker up front, so no request pays for loading the catalog
+    global _request_executor
+    loop = asyncio.get_running_loop()
+    executor = get_request_executor()
+    await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, api_workers.ping)
+            for _ in range(config.REQUEST_POOL_SIZE)
+        )
+    )
+    yield
+    with _request_executor_lock:
+        _request_executor = None
+    executor.shutdown()
+    # Solver pools of this process (e.g. with REQUEST_EXECUTOR=thread)
+    api_workers.shutdown_solver_pools()
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+
+@app.middleware("http")
+async def request_logging_context(request, call_next):
+    """Tag the request's log records with its X-Request-ID (or a new id) and echo it back."""
+    request_id = structured_logging.new_request(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 
 # Pydantic Models for Meal Generation
@@ -33,6 +161,25 @@ class MealSelection(BaseModel):
     user_selected_items: (
         dict  # Example: {"Breakfast": ["item1", "item2"], "Lunch": ["item3"]}
     )
+    solver: str = "ga"  # "ga", "lp" (exact solver), "lsq" or "island"
+    # Optional GA stopping criteria; time_budget_ms is the latency budget for the plan
+    target_fitness: Optional[float] = None
+    stall_generations: Optional[int] = None
+    time_budget_ms: Optional[float] = None
+    # RNG seed for reproducible plans; derived from the request when omitted
+    seed: Optional[int] = None
+    # Optimize all meals together against the daily totals (one solve per request)
+    joint: bool = False
+    # Reuse the plan solved for the targets rounded to CALORIE_BUCKET/GRAM_BUCKET,
+    # refined to the exact targets; the response reports the rounding. Ignored for
+    # joint plans: refining meal by meal would undo the whole-day optimization
+    quantize: bool = False
+
+
+# One user's request in a /generate_meal_plans:batch body
+class MealPlanRequest(BaseModel):
+    user_input: UserInput
+    meal_selection: MealSelection
 
 
 # Updated Pydantic Models for Recommendation
@@ -70,6 +217,12 @@ class RecommendationInput(BaseModel):
     target_macros: dict[
         str, TargetMacros
     ]  # Example: {"Breakfast": {...}, "Lunch": {...}}
+    # "similarity" (signed macro score), "nearest" (macro-space nearest neighbours)
+    # or "nutrient" (similarity among foods that improve the critical nutrient)
+    search: str = "similarity"
+    # Alternatives per item from the same reverse cluster, then from the others
+    top_within: int = Field(TOP_WITHIN_CLUSTER, ge=0, le=MAX_ALTERNATIVES)
+    top_outside: int = Field(TOP_OUTSIDE_CLUSTER, ge=0, le=MAX_ALTERNATIVES)
 
 
 @app.get("/")
@@ -79,148 +232,302 @@ def read_root():
 
 # Meal Generation API
 @app.post("/generate_meal_plan")
-def generate_meal_plan(user_input: UserInput, meal_selection: MealSelection):
+async def generate_meal_plan(user_input: UserInput, meal_selection: MealSelection):
     """Endpoint to generate meal plan based on user input and meal selection."""
 
-    logging.debug("Generating meal plan for user: %s", user_input.name)
+    logger.debug("Generating meal plan for user: %s", user_input.name)
 
-    # Step 1: Create a User instance
     user = User(
         name=user_input.name,
         age=user_input.age,
         weight=user_input.weight,
         height=user_input.height,
         activity_level=user_input.activity_level,
-        goal=user_input.goal,  # Include goal
-        gender=user_input.gender,  # Include gender
+        goal=user_input.goal,
+        gender=user_input.gender,
     )
+    try:
+        user.calculate_macros()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if quantized(meal_selection):
+        return await generate_quantized_plan(user, user_input, meal_selection)
 
-    # Step 2: Calculate the user's macros
-    user.calculate_macros()
-    logging.debug(
-        "User's target nutrients: Calories=%s, Protein=%s, Carbs=%s, Fats=%s",
-        user.calories,
-        user.protein,
-        user.carbs,
-        user.fats,
-    )
-
-    # Step 3: Initialize MealGenerator
-    meal_generator = MealGenerator(user, meal_selection.meals, df)
-
-    # Step 4: Generate the full meal plan
-    meal_plan = meal_generator.generate_full_plan(meal_selection.user_selected_items)
-
-    if not meal_plan:
-        logging.error("Meal plan generation failed for user: %s", user_input.name)
-        raise HTTPException(status_code=400, detail="Meal plan generation failed.")
+    selection, key = plan_request(user, meal_selection)
+    response = plan_cache.get(key)
+    if response is not None:
+        return response
 
-    # Step 5: Calculate adjusted macros
-    adjusted_macros = meal_generator.calculate_adjusted_macros(
-        user, meal_selection.meals
+    try:
+        response = await offload(
+            api_workers.generate_meal_plan, user_input.model_dump(), selection
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    plan_cache.set(key, response)
+    return response
+
+
+def quantized(meal_selection):
+    """Whether a plan request is served from its target bucket (see MealSelection.quantize)."""
+    return meal_selection.quantize and not meal_selection.joint
+
+
+def plan_request(user, meal_selection):
+    """Return the (selection dict with its seed, plan cache key) of a plan request.
+
+    Quantized requests are seeded and keyed by their target bucket, and their
+    cache entry holds the bucket's solutions instead of a response.
+    """
+    targets = [user.calories, user.protein, user.carbs, user.fats]
+    if quantized(meal_selection):
+        # From the bucket, so every user in it gets the same bucket plan
+        targets = list(quantize_macros(api_workers.user_macros(user)).values())
+
+    # Seeded so the same request gives the same plan
+    selection = meal_selection.model_dump(exclude={"quantize"})
+    if selection["seed"] is None:
+        selection["seed"] = derive_seed(targets, selection)
+
+    # The plan depends on the computed targets, not on who asked for it
+    key = cache_key(
+        *(["quantized"] if quantized(meal_selection) else []),
+        targets,
+        selection["meals"],
+        {
+            meal: sorted(items)
+            for meal, items in selection["user_selected_items"].items()
+        },
+        {option: selection[option] for option in PLAN_OPTIONS},
+        SOLVER_VERSION,
+        selection["seed"],
     )
+    return selection, key
 
-    # Step 6: Calculate actual macros from the meal plan
-    actual_macros = {}
-    for meal_name, details in meal_plan.items():
-        actual_macros[meal_name] = details["macros"]
 
-    # Step 7: Calculate the differences between target macros and actual meal plan macros
-    macro_differences = meal_generator.calculate_macro_differences(
-        adjusted_macros, actual_macros
+async def generate_quantized_plan(user, user_input, meal_selection):
+    """The quantized /generate_meal_plan: users in the same target bucket share one solve."""
+    selection, key = plan_request(user, meal_selection)
+    # The cache holds the bucket's portions, the refinement runs per request
+    solutions = plan_cache.get(key)
+    try:
+        response, bucket_solutions = await offload(
+            api_workers.generate_quantized_plan,
+            user_input.model_dump(),
+            selection,
+            solutions,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response["quantization"]["bucket_cached"] = solutions is not None
+    if solutions is None:
+        plan_cache.set(key, bucket_solutions)
+    return response
+
+
+@app.post("/generate_meal_plans:batch")
+async def generate_meal_plans_batch(plan_requests: List[MealPlanRequest]):
+    """Generate the meal plans of many users, streamed as NDJSON in completion order.
+
+    Each line is {"index": position in the batch, ...} with the /generate_meal_plan
+    response, or an "error". Cached plans are sent first; the rest are solved
+    together on the request pool, identical solver tasks only once.
+
+    The batch keeps up to one solver task per pool worker in flight, and counts
+    them as pending requests until the response is sent, like offload().
+    """
+    global _pending_requests
+    slots = max(
+        1,
+        min(
+            config.REQUEST_POOL_SIZE,
+            sum(
+                len(batch_request.meal_selection.user_selected_items)
+                for batch_request in plan_requests
+            ),
+        ),
+    )
+    # Reserved with the capacity check, so concurrent batches cannot both pass it
+    check_capacity(slots)
+    _pending_requests += slots
+
+    async def lines():
+        try:
+            async for index, response in iterate_in_threadpool(
+                batch_meal_plans(plan_requests, slots)
+            ):
+                yield json.dumps({"index": index, **response}) + "\n"
+        except Exception as e:
+            # The status line is already sent, so report the failure in the stream
+            logger.error("Error generating batch meal plans: %s", e)
+            yield json.dumps({"error": "Internal server error"}) + "\n"
+
+    return ReservedStreamingResponse(
+        lines(), slots=slots, media_type="application/x-ndjson"
     )
 
-    logging.debug("Generated meal plan: %s", meal_plan)
-    logging.debug("Adjusted Macros: %s", adjusted_macros)
-    logging.debug("Macro Differences: %s", macro_differences)
 
-    # Step 8: Return the meal plan along with adjusted macros and macro differences
+def batch_error(index, error):
+    """The response line of a batch request that failed (the other requests go on)."""
+    if isinstance(error, ValueError):
+        return {"error": str(error)}
+    logger.error("Error generating meal plan %d of a batch: %r", index, error)
+    return {"error": "Internal server error"}
+
+
+def batch_meal_plans(plan_requests, max_pending=config.REQUEST_POOL_SIZE):
+    """Yield (index, response) for every request of a batch, in completion order.
+
+    At most max_pending solver tasks are on the request pool at a time.
+    """
+    jobs = []
+    requests = []
+    for index, batch_request in enumerate(plan_requests):
+        user_input = batch_request.user_input.model_dump()
+        quantize = quantized(batch_request.meal_selection)
+        try:
+            user = api_workers.create_user(user_input)
+            selection, key = plan_request(user, batch_request.meal_selection)
+            cached = plan_cache.get(key)
+            if cached is not None:
+                if quantize:
+                    cached, _ = api_workers.generate_quantized_plan(
+                        user_input, selection, cached
+                    )
+                    cached["quantization"]["bucket_cached"] = True
+                yield index, cached
+                continue
+            meal_generator = api_workers.create_meal_generator(
+                api_workers.create_bucket_user(user_input) if quantize else user,
+                selection,
+            )
+        except Exception as e:
+            yield index, batch_error(index, e)
+            continue
+        jobs.append((meal_generator, selection["user_selected_items"]))
+        requests.append((index, user_input, user, selection, key, quantize))
+
+    for position, meal_plan, error in MealGenerator.generate_batch(
+        jobs, get_request_executor(), max_pending=max_pending
+    ):
+        meal_generator = jobs[position][0]
+        index, user_input, user, selection, key, quantize = requests[position]
+        if error is not None:
+            yield index, batch_error(index, error)
+            continue
+        try:
+            if quantize:
+                # Refine the bucket's plan to this user's exact targets
+                response, solutions = api_workers.generate_quantized_plan(
+                    user_input, selection, meal_generator.solutions
+                )
+                response["quantization"]["bucket_cached"] = False
+                plan_cache.set(key, solutions)
+            else:
+                response = api_workers.plan_response(
+                    user, selection, meal_generator, meal_plan, user_input
+                )
+                plan_cache.set(key, response)
+        except Exception as e:
+            response = batch_error(index, e)
+        yield index, response
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Hit/miss counters of the meal plan response cache and of the recommendation
+    caches, which each request worker keeps for itself: one task per worker is
+    submitted and the answers are keyed by worker pid."""
+    worker_stats = await asyncio.gather(
+        *(offload(api_workers.cache_stats) for _ in range(config.REQUEST_POOL_SIZE))
+    )
     return {
-        "meal_plan": meal_plan,
-        "adjusted_macros_per_meal": adjusted_macros,
-        "macro_differences": macro_differences,
+        "plan_cache": plan_cache.stats(),
+        "recommendation_caches": {str(pid): stats for pid, stats in worker_stats},
     }
 
 
+def check_search_mode(recommendation_input):
+    if recommendation_input.search not in api_workers.SEARCH_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown search mode: {recommendation_input.search}",
+        )
+
+
 # Recommendation API using rule-based engine
 @app.post("/generate_recommendations")
-def generate_recommendations(recommendation_input: RecommendationInput):
+async def generate_recommendations(recommendation_input: RecommendationInput):
     """Endpoint to generate meal recommendations based on input meal plan and target macros."""
 
-    logging.debug(
-        "Generating recommendations for meal plan: %s", recommendation_input.meal_plan
-    )
-
-    # Ensure 'quantity' exists in the original food item, or assign a default
-    for meal in recommendation_input.meal_plan.meals.values():
-        for item in meal.items:
-            if not item.quantity:
-                item.quantity = "100 g"  # Assign a default if missing
-
-    # Convert MealDetails and MealItem to a dictionary-like structure for the recommendation engine
-    meal_plan = {}
-    for meal_name, meal_details in recommendation_input.meal_plan.meals.items():
-        meal_plan[meal_name] = {
-            "items": [
-                {
-                    "name": item.name,
-                    "macros": {
-                        "calories": item.macros.calories,
-                        "protein": item.macros.protein,
-                        "carbs": item.macros.carbs,
-                        "fats": item.macros.fats,
-                    },
-                    "quantity": item.quantity,  # Include quantity in meal item
-                }
-                for item in meal_details.items
-            ],
-            "macros": {
-                "calories": meal_details.macros.calories,
-                "protein": meal_details.macros.protein,
-                "carbs": meal_details.macros.carbs,
-                "fats": meal_details.macros.fats,
-            },
-        }
-
-    logging.debug("Transformed meal plan for recommendation engine: %s", meal_plan)
-
-    # Extract the target macros
-    target_macros = {
-        meal_name: {
-            "calories": target.calories,
-            "protein": target.protein,
-            "carbs": target.carbs,
-            "fats": target.fats,
-        }
-        for meal_name, target in recommendation_input.target_macros.items()
-    }
-
-    logging.debug("Target macros: %s", target_macros)
-
-    # Initialize RuleBasedRecommendationEngine with the user's target macros for all meals
-    rule_based_recommendation_engine = RuleBasedRecommendationEngine(
-        df,
-        {
-            "calories": sum(target["calories"] for target in target_macros.values()),
-            "protein": sum(target["protein"] for target in target_macros.values()),
-            "carbs": sum(target["carbs"] for target in target_macros.values()),
-            "fats": sum(target["fats"] for target in target_macros.values()),
-        },
+    structured_logging.log_payload(
+        logger,
+        "Generating recommendations for meal plan",
+        recommendation_input.meal_plan,
     )
+    check_search_mode(recommendation_input)
 
     # Generate recommendations using rule-based engine
     try:
-        recommendations = rule_based_recommendation_engine.generate_recommendations(
-            meal_plan=meal_plan
+        recommendations = await offload(
+            api_workers.generate_recommendations, recommendation_input.model_dump()
         )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # e.g. an unknown food item, like /generate_recommendations/stream
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logging.error("Error generating recommendations: %s", e)
+        logger.error("Error generating recommendations: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
     if not recommendations:
-        logging.error("Recommendation generation failed for meal plan: %s", meal_plan)
+        logger.error(
+            "Recommendation generation failed for a meal plan of %d items",
+            sum(
+                len(meal.items)
+                for meal in recommendation_input.meal_plan.meals.values()
+            ),
+        )
+        structured_logging.log_payload(
+            logger, "Meal plan without recommendations", recommendation_input.meal_plan
+        )
         raise HTTPException(status_code=400, detail="Recommendation generation failed.")
 
-    logging.debug("Generated recommendations: %s", recommendations)
-
     return recommendations
+
+
+@app.post("/generate_recommendations/stream")
+def stream_recommendations(recommendation_input: RecommendationInput):
+    """Stream the recommendations as NDJSON, one line per meal item as soon as it is computed.
+
+    Runs in this process, item by item, rather than on the request pool.
+    """
+    check_search_mode(recommendation_input)
+    rule_based_recommendation_engine, meal_plan = api_workers.prepare_recommendations(
+        recommendation_input.model_dump()
+    )
+    # Unknown foods would only fail mid-stream, after the 200 status is sent
+    unknown = [
+        item["name"]
+        for meal_details in meal_plan.values()
+        for item in meal_details["items"]
+        if item["name"] not in catalog
+    ]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown food items: {', '.join(unknown)}"
+        )
+
+    def lines():
+        try:
+            for recommendation in rule_based_recommendation_engine.iter_recommendations(
+                meal_plan
+            ):
+                yield json.dumps(recommendation) + "\n"
+        except Exception as e:
+            # The status line is already sent, so report the failure in the stream
+            logger.error("Error streaming recommendations: %s", e)
+            yield json.dumps({"error": "Internal server error"}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,26 +1,190 @@
 import random
 import numpy as np
-from genetic_algo import GeneticAlgorithm
+from genetic_algo import FOOD_SET_NUTRIENTS, FoodSet, GeneticAlgorithm, derive_seed
+from portion_solver import JointPortionSolver, PortionSolver
+from island_ga import IslandGeneticAlgorithm, shutdown_island_executor
+from cache import LRUCache
+from food_catalog import get_catalog
 from user import User
 import streamlit as st
+import os
 import re
+import time
+import logging
+import threading
+from collections import deque
+from multiprocessing import util
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import config
+
+logger = logging.getLogger(__name__)
+
+# Compiled food sets, keyed by the catalog version and the sorted names of the
+# selected foods
+FOOD_SET_CACHE_SIZE = 512
+food_set_cache = LRUCache(maxsize=FOOD_SET_CACHE_SIZE)
+
+# Portion optimizers selectable per request
+SOLVERS = ["ga", "lp", "lsq", "island"]
+# Bump whenever a solver change alters the plans generated for the same request,
+# so cached plans from the previous version are not served
+SOLVER_VERSION = 1
+
+# Target quantization: calories snap to CALORIE_BUCKET kcal and protein, carbs and
+# fats to GRAM_BUCKET g, so near-identical users share one solved plan
+CALORIE_BUCKET = 25
+GRAM_BUCKET = 2
+
+# Worker pool shared by every MealGenerator, created on first use
+_meal_executor = None
+_meal_executor_lock = threading.Lock()
+
+
+def get_meal_executor():
+    """Return the shared pool used to optimize meals concurrently, sized from config."""
+    global _meal_executor
+    with _meal_executor_lock:
+        if _meal_executor is None:
+            if config.MEAL_EXECUTOR == "process":
+                _meal_executor = ProcessPoolExecutor(
+                    max_workers=config.MEAL_POOL_SIZE, initializer=init_meal_worker
+                )
+            else:
+                _meal_executor = ThreadPoolExecutor(max_workers=config.MEAL_POOL_SIZE)
+    return _meal_executor
+
+
+def shutdown_meal_executor():
+    """Shut down the shared meal pool, if it was created."""
+    global _meal_executor
+    with _meal_executor_lock:
+        executor, _meal_executor = _meal_executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def _forget_meal_executor():
+    """Drop the meal pool inherited by a forked child (see _forget_island_executor)."""
+    global _meal_executor, _meal_executor_lock
+    _meal_executor = None
+    _meal_executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_meal_executor)
+
+
+def init_meal_worker():
+    """Initializer of the meal worker processes.
+
+    Islands evolved in a meal worker run on threads rather than on a nested
+    process pool, and that pool is shut down when the worker exits (before
+    multiprocessing joins the worker's children).
+    """
+    config.ISLAND_EXECUTOR = "thread"
+    util.Finalize(None, shutdown_island_executor, exitpriority=10)
+
+
+def create_solver(food_set, target_nutrients, solver="ga", **options):
+    """Create the portion optimizer for a meal; all solvers share the run() contract."""
+    if solver == "lp":
+        return PortionSolver(food_set.food_items, target_nutrients, food_set=food_set)
+    if solver == "island":
+        return IslandGeneticAlgorithm(
+            food_set.food_items, target_nutrients, food_set=food_set, **options
+        )
+    if solver in ("ga", "lsq"):
+        return GeneticAlgorithm(
+            food_set.food_items,
+            target_nutrients,
+            food_set=food_set,
+            fast_path=solver == "lsq",
+            **options,
+        )
+    raise ValueError(f"Solver must be one of: {', '.join(SOLVERS)}.")
+
+
+def quantize_macros(macros, calorie_bucket=CALORIE_BUCKET, gram_bucket=GRAM_BUCKET):
+    """Round calories to calorie_bucket and the other macros to gram_bucket."""
+    quantized = {}
+    for nutrient, value in macros.items():
+        bucket = calorie_bucket if nutrient == "calories" else gram_bucket
+        quantized[nutrient] = round(value / bucket) * bucket
+    return quantized
+
+
+def refine_portions(food_set, target_nutrients, solution):
+    """Locally re-solve a solution found for nearby targets (see GeneticAlgorithm.refine)."""
+    ga = GeneticAlgorithm(food_set.food_items, target_nutrients, food_set=food_set)
+    best_solution, best_fitness_score = ga.refine(solution)
+    return best_solution, best_fitness_score, "refined"
+
+
+def optimize_portions(food_set, target_nutrients, solver="ga", **options):
+    """Optimize the portions of one meal (module-level so a process pool can run it)."""
+    optimizer = create_solver(food_set, target_nutrients, solver, **options)
+    best_solution, best_fitness_score = optimizer.run()
+    return best_solution, best_fitness_score, optimizer.stop_reason
+
+
+def optimize_joint_portions(food_sets, targets):
+    """Optimize the portions of several meals together, {meal: (solution, score, stop reason)}."""
+    solver = JointPortionSolver(food_sets, targets)
+    return {
+        meal: (best_solution, best_fitness_score, solver.stop_reason)
+        for meal, (best_solution, best_fitness_score) in solver.run().items()
+    }
 
 
 class MealGenerator:
-    def __init__(self, user, meals, df):
+    def __init__(
+        self,
+        user,
+        meals,
+        df,
+        vectorized=True,
+        solver="ga",
+        target_fitness=None,
+        stall_generations=None,
+        time_budget_ms=None,
+        parallel=config.PARALLEL_MEALS,
+        seed=None,
+        joint=False,
+        catalog=None,
+    ):
         self.user = user
         self.meals = meals  # e.g., {"Breakfast": 0.3, "Lunch": 0.4, "Dinner": 0.3}
         self.df = df
+        # Shared FoodCatalog for O(1) lookups by name
+        self.catalog = catalog if catalog is not None else get_catalog(df)
+        self.vectorized = vectorized  # Use the NumPy population engine
+        if solver not in SOLVERS:
+            raise ValueError(f"Solver must be one of: {', '.join(SOLVERS)}.")
+        # "ga" (genetic algorithm), "lp" (exact PortionSolver), "lsq"
+        # (least-squares fast path with GA fallback) or "island" (multi-process GA)
+        self.solver = solver
+        # GA stopping criteria; time_budget_ms covers the whole plan
+        self.target_fitness = target_fitness
+        self.stall_generations = stall_generations
+        self.time_budget_ms = time_budget_ms
+        # Optimize the meals of a plan concurrently on the shared worker pool
+        self.parallel = parallel
+        # Same inputs and seed give the same plan; each meal derives its own seed
+        self.seed = seed
+        # Optimize all meals' portions in one problem against the daily totals
+        self.joint = joint
         self.final_meal_plan = {}
+        # Best portions per meal, {food name: portion}, e.g. to refine for other targets
+        self.solutions = {}
 
     def sum_selected_items(self, selected_items):
         """Sum up the nutritional values of the user-selected food items."""
         food_items = []
-        for item in selected_items:
-            row = self.df[self.df["FOOD ITEM"] == item]
-            if row.empty:
-                continue
-            row = row.iloc[0]
+        for row in self.catalog.get_many(selected_items):
             food_items.append(
                 {
                     "name": row["FOOD ITEM"],
@@ -42,35 +206,79 @@ class MealGenerator:
 
         return food_items, None
 
-    def generate_meal(self, meal_name, selected_items):
-        """Generate a meal using the genetic algorithm."""
-        food_items, error_message = self.sum_selected_items(selected_items)
-        if error_message:
-            self.final_meal_plan[meal_name] = {
-                "items": [],
-                "macros": {},
-                "message": error_message,
-            }
-            return
+    def compile_food_set(self, selected_items):
+        """Return the compiled FoodSet for the selected items, reusing cached compilations."""
+        key = (self.catalog.version, tuple(sorted(selected_items)))
+        food_set = food_set_cache.get(key)
+        if food_set is None:
+            food_items, _ = self.sum_selected_items(key[1])
+            food_set = FoodSet(food_items or [])
+            food_set_cache.set(key, food_set)
+        if not len(food_set):
+            return None, "No food items selected."
+        return food_set.reorder(selected_items), None
 
-        # Define target nutrients for the meal
-        target_nutrients = {
+    def solver_options(self, meal_name, time_budget_ms=None):
+        """Keyword arguments for the GA solvers of this generator."""
+        if self.solver == "lp":
+            return {}
+        seed = None if self.seed is None else derive_seed(self.seed, meal_name)
+        options = {
+            "seed": seed,
+            "target_fitness": self.target_fitness,
+            "stall_generations": self.stall_generations,
+            "time_budget_ms": time_budget_ms,
+        }
+        if self.solver != "island":
+            options["vectorized"] = self.vectorized
+        return options
+
+    def meal_targets(self, meal_name):
+        """Define target nutrients for the meal from the user's share for it."""
+        if meal_name not in self.meals:
+            raise ValueError(
+                f"No share of the daily macros given for meal {meal_name}."
+            )
+        return {
             "calories": self.user.calories * self.meals[meal_name],
             "protein": self.user.protein * self.meals[meal_name],
             "carbs": self.user.carbs * self.meals[meal_name],
             "fats": self.user.fats * self.meals[meal_name],
         }
 
-        # Initialize and run the genetic algorithm
-        ga = GeneticAlgorithm(food_items, target_nutrients)
-        best_solution, best_fitness_score = ga.run()
+    def generate_meal(self, meal_name, selected_items, time_budget_ms=None):
+        """Generate a meal using the genetic algorithm or the exact portion solver."""
+        food_set, error_message = self.compile_food_set(selected_items)
+        if error_message:
+            self.final_meal_plan[meal_name] = {
+                "items": [],
+                "macros": {},
+                "message": error_message,
+            }
+            return
 
-        # Calculate the nutritional values of the best solution
-        best_calories, best_protein, best_carbs, best_fats = ga.calculate_nutrients(
-            best_solution
+        # Run the portion optimizer and format the best meal plan
+        self.final_meal_plan[meal_name] = self.format_meal(
+            food_set,
+            *optimize_portions(
+                food_set,
+                self.meal_targets(meal_name),
+                self.solver,
+                **self.solver_options(meal_name, time_budget_ms),
+            ),
+            meal_name=meal_name,
         )
 
-        # Format the best meal plan
+    def format_meal(
+        self, food_set, best_solution, best_fitness_score, stop_reason, meal_name=None
+    ):
+        """Build the meal plan entry for an optimized solution."""
+        if meal_name is not None:
+            self.solutions[meal_name] = dict(
+                zip(food_set.names, np.asarray(best_solution, dtype=float).tolist())
+            )
+        food_items = food_set.food_items
+        item_nutrients = food_set.nutrients(best_solution)
         meal_items = [
             {
                 "name": food_items[i]["name"],
@@ -80,64 +288,219 @@ class MealGenerator:
                     else f"{best_solution[i]}*({int(food_items[i]['quantity'])} {food_items[i]['unit']})"
                 ),
                 "macros": {
-                    "calories": (
-                        food_items[i]["calories"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["calories"] * best_solution[i]
-                    ),
-                    "protein": (
-                        food_items[i]["protein"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["protein"] * best_solution[i]
-                    ),
-                    "carbs": (
-                        food_items[i]["carbs"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["carbs"] * best_solution[i]
-                    ),
-                    "fats": (
-                        food_items[i]["fats"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["fats"] * best_solution[i]
-                    ),
-                    "sugars": (
-                        food_items[i]["sugars"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["sugars"] * best_solution[i]
-                    ),
-                    "fiber": (
-                        food_items[i]["fiber"]
-                        * (best_solution[i] / food_items[i]["quantity"])
-                        if food_items[i]["unit_category"] == "Base Units"
-                        else food_items[i]["fiber"] * best_solution[i]
-                    ),
+                    nutrient: float(item_nutrients[i, column])
+                    for column, nutrient in enumerate(FOOD_SET_NUTRIENTS)
                 },
             }
             for i in range(len(food_items))
         ]
 
-        self.final_meal_plan[meal_name] = {
+        # Calculate the nutritional values of the best solution
+        totals = item_nutrients.sum(axis=0)
+        return {
             "items": meal_items,
             "macros": {
-                "calories": best_calories,
-                "protein": best_protein,
-                "carbs": best_carbs,
-                "fats": best_fats,
-                "sugars": sum(item["macros"]["sugars"] for item in meal_items),
-                "fiber": sum(item["macros"]["fiber"] for item in meal_items),
+                nutrient: float(totals[column])
+                for column, nutrient in enumerate(FOOD_SET_NUTRIENTS)
             },
             "fitness_score": best_fitness_score,
+            "stop_reason": stop_reason,
         }
 
     def generate_full_plan(self, user_selected_items):
         """Generate the full meal plan using the genetic algorithm."""
+        if self.joint:
+            return self.generate_joint_plan(user_selected_items)
+        if self.parallel:
+            return self.generate_full_plan_parallel(user_selected_items)
+        start_time = time.perf_counter()
+        remaining_meals = len(user_selected_items)
         for meal, selected_items in user_selected_items.items():
-            self.generate_meal(meal, selected_items)
+            time_budget_ms = None
+            if self.time_budget_ms is not None:
+                # Share what is left of the plan budget among the remaining meals
+                elapsed_ms = (time.perf_counter() - start_time) * 1000
+                time_budget_ms = (
+                    max(self.time_budget_ms - elapsed_ms, 0) / remaining_meals
+                )
+            self.generate_meal(meal, selected_items, time_budget_ms=time_budget_ms)
+            remaining_meals -= 1
+        return self.final_meal_plan
+
+    def generate_full_plan_parallel(self, user_selected_items):
+        """Generate the full meal plan with the meals optimized concurrently."""
+        for _, _, error in MealGenerator.generate_batch(
+            [(self, user_selected_items)], get_meal_executor()
+        ):
+            if error is not None:
+                raise error
+        return self.final_meal_plan
+
+    def plan_tasks(self, user_selected_items):
+        """Split the plan into solver tasks, as [(key, function, args, kwargs, food sets)].
+
+        The key identifies the problem (food sets, targets, solver and its options),
+        so equal tasks of different plans can be solved once. Every task returns
+        {meal: (solution, score, stop reason)} for its food sets. Meals without
+        foods get their message entry right away.
+        """
+        food_sets = {}
+        for meal, selected_items in user_selected_items.items():
+            food_set, error_message = self.compile_food_set(selected_items)
+            if error_message:
+                self.final_meal_plan[meal] = {
+                    "items": [],
+                    "macros": {},
+                    "message": error_message,
+                }
+                continue
+            # Reserve the slot so the plan keeps the order of the selected meals
+            self.final_meal_plan[meal] = None
+            food_sets[meal] = food_set
+
+        targets = {meal: self.meal_targets(meal) for meal in food_sets}
+        if self.joint:
+            if not food_sets:
+                return []
+            key = (
+                self.catalog.version,
+                "joint",
+                tuple(
+                    (tuple(food_set.names), tuple(targets[meal].values()))
+                    for meal, food_set in food_sets.items()
+                ),
+            )
+            return [(key, optimize_joint_portions, (food_sets, targets), {}, food_sets)]
+
+        tasks = []
+        for meal, food_set in food_sets.items():
+            # Meals run side by side, so each one gets the whole budget
+            options = self.solver_options(meal, self.time_budget_ms)
+            key = (
+                self.catalog.version,
+                tuple(food_set.names),
+                tuple(targets[meal].values()),
+                self.solver,
+                tuple(sorted(options.items())),
+            )
+            tasks.append(
+                (
+                    key,
+                    optimize_portions,
+                    (food_set, targets[meal], self.solver),
+                    options,
+                    {meal: food_set},
+                )
+            )
+        return tasks
+
+    def finish_task(self, food_sets, result):
+        """Format the meals of a solved plan task; result as returned by the task."""
+        if not isinstance(result, dict):
+            # A single meal's (solution, score, stop reason)
+            (meal,) = food_sets
+            result = {meal: result}
+        for meal, (best_solution, best_fitness_score, stop_reason) in result.items():
+            self.final_meal_plan[meal] = self.format_meal(
+                food_sets[meal],
+                best_solution,
+                best_fitness_score,
+                stop_reason,
+                meal_name=meal,
+            )
+
+    @staticmethod
+    def generate_batch(jobs, executor, max_pending=None):
+        """Generate the plans of many (MealGenerator, user_selected_items) jobs together.
+
+        Identical solver tasks of different jobs (see plan_tasks) are solved once,
+        on the executor, with at most max_pending of them submitted at a time.
+        Yields (position of the job, meal plan, None) as the plans complete, or
+        (position, None, exception) for a job that failed; the other jobs go on.
+        """
+        jobs = list(jobs)
+        tasks = {}
+        remaining = {}
+        failed = set()
+        for position, (meal_generator, user_selected_items) in enumerate(jobs):
+            try:
+                plan_tasks = meal_generator.plan_tasks(user_selected_items)
+            except Exception as e:
+                failed.add(position)
+                yield position, None, e
+                continue
+            remaining[position] = len(plan_tasks)
+            if not plan_tasks:
+                yield position, meal_generator.final_meal_plan, None
+            for key, function, args, kwargs, food_sets in plan_tasks:
+                if key not in tasks:
+                    tasks[key] = (function, args, kwargs, [])
+                tasks[key][3].append((position, food_sets))
+        logger.debug("Batch of %d plans: %d solver tasks", len(jobs), len(tasks))
+
+        queued = deque(tasks.values())
+        running = {}
+        while queued or running:
+            while queued and (max_pending is None or len(running) < max_pending):
+                function, args, kwargs, subscribers = queued.popleft()
+                if all(position in failed for position, _ in subscribers):
+                    continue
+                running[executor.submit(function, *args, **kwargs)] = subscribers
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                subscribers = running.pop(future)
+                for position, food_sets in subscribers:
+                    if position in failed:
+                        continue
+                    try:
+                        jobs[position][0].finish_task(food_sets, future.result())
+                    except Exception as e:
+                        failed.add(position)
+                        yield position, None, e
+                        continue
+                    remaining[position] -= 1
+                    if not remaining[position]:
+                        yield position, jobs[position][0].final_meal_plan, None
+
+    def refine_plan(self, user_selected_items, solutions):
+        """Build the full meal plan from solutions found for nearby targets.
+
+        Each meal starts from solutions[meal] ({food name: portion}) and is locally
+        refined to this generator's targets; meals without one are optimized as usual.
+        Joint plans cannot be refined meal by meal.
+        """
+        if self.joint:
+            raise ValueError("Joint meal plans cannot be refined meal by meal.")
+        for meal, selected_items in user_selected_items.items():
+            food_set, error_message = self.compile_food_set(selected_items)
+            if error_message:
+                self.final_meal_plan[meal] = {
+                    "items": [],
+                    "macros": {},
+                    "message": error_message,
+                }
+                continue
+            solution = solutions.get(meal, {})
+            if set(solution) != set(food_set.names):
+                self.generate_meal(meal, selected_items)
+                continue
+            self.final_meal_plan[meal] = self.format_meal(
+                food_set,
+                *refine_portions(
+                    food_set,
+                    self.meal_targets(meal),
+                    [solution[name] for name in food_set.names],
+                ),
+                meal_name=meal,
+            )
+        return self.final_meal_plan
+
+    def generate_joint_plan(self, user_selected_items):
+        """Generate the full meal plan by optimizing all meals together (JointPortionSolver)."""
+        for _, _, args, _, food_sets in self.plan_tasks(user_selected_items):
+            self.finish_task(food_sets, optimize_joint_portions(*args))
         return self.final_meal_plan
 
     # Function to extract numeric portion from a string like "120.15 g"
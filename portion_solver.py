@@ -0,0 +1,192 @@
+import math
+import numpy as np
+import pulp
+from genetic_algo import HIGH_PROTEIN_WEIGHT, NUTRIENTS, FoodSet
+
+# Joint whole-day mode: weight of the per-meal split deviations relative to the
+# daily totals, which are the primary objective
+MEAL_SPLIT_PENALTY = 0.1
+
+
+def portion_variables(food_set, prefix, integer_counts=True):
+    """Create one bounded portion variable per food, integer for count units if requested."""
+    return [
+        pulp.LpVariable(
+            f"{prefix}_Qty_{i}",
+            lowBound=food_set.lower[i],
+            upBound=food_set.upper[i],
+            cat=(
+                "Integer" if integer_counts and food_set.count_mask[i] else "Continuous"
+            ),
+        )
+        for i in range(len(food_set))
+    ]
+
+
+def nutrient_totals(food_set, portions):
+    """Linear expressions for the calories/protein/carbs/fats totals of the portions."""
+    return [
+        pulp.lpSum(
+            float(food_set.nutrient_matrix[i, j]) * portions[i]
+            for i in range(len(food_set))
+        )
+        for j in range(len(NUTRIENTS))
+    ]
+
+
+def weighted_deviation(prob, totals, target_vector, weights, prefix):
+    """Constrain absolute deviation variables per nutrient and return their weighted sum."""
+    deviation = [
+        pulp.LpVariable(f"{prefix}_Deviation_{nutrient}", lowBound=0)
+        for nutrient in NUTRIENTS
+    ]
+    for j in range(len(NUTRIENTS)):
+        prob += totals[j] - target_vector[j] <= deviation[j]
+        prob += target_vector[j] - totals[j] <= deviation[j]
+    # Scale by sqrt(weight) so the deviations are weighted like the GA fitness
+    return pulp.lpSum(
+        math.sqrt(weights[j]) * deviation[j] for j in range(len(NUTRIENTS))
+    )
+
+
+def solution_values(food_set, portions):
+    """Read the solved portions back as a chromosome (integers for count units)."""
+    best_solution = []
+    for i, portion in enumerate(portions):
+        qty = min(max(portion.varValue or 0.0, food_set.lower[i]), food_set.upper[i])
+        if food_set.base_mask[i]:
+            best_solution.append(float(qty))
+        else:
+            best_solution.append(int(round(qty)))
+    return best_solution
+
+
+def solve(prob):
+    prob.solve(pulp.PULP_CBC_CMD(msg=False))
+    if pulp.LpStatus[prob.status] != "Optimal":
+        raise ValueError(
+            f"Portion solver failed with status {pulp.LpStatus[prob.status]}."
+        )
+
+
+class PortionSolver:
+    """Exact minimal-deviation portions for a meal, solved as a (mixed-integer) linear program.
+
+    Takes the same food_items/target_nutrients as GeneticAlgorithm and returns the
+    same (best_solution, fitness) tuple from run(), so the two are interchangeable.
+    """
+
+    def __init__(
+        self, food_items, target_nutrients, food_set=None, integer_counts=True
+    ):
+        self.food_items = food_items
+        self.target_nutrients = target_nutrients
+        # Solve count units as integers (MILP); otherwise solve the LP and round them
+        self.integer_counts = integer_counts
+        self.food_set = food_set if food_set is not None else FoodSet(food_items)
+        self.nutrient_matrix = self.food_set.nutrient_matrix
+        self.target_vector = np.array(
+            [target_nutrients[n] for n in NUTRIENTS], dtype=float
+        )
+        self.weights = np.array([1, self.food_set.protein_weight, 1, 1], dtype=float)
+        self.stop_reason = None
+
+    def build_problem(self):
+        """Build the L1-deviation problem: minimize the weighted absolute deviation per nutrient."""
+        prob = pulp.LpProblem("Meal_Portions", pulp.LpMinimize)
+        portions = portion_variables(self.food_set, "Meal", self.integer_counts)
+        prob += weighted_deviation(
+            prob,
+            nutrient_totals(self.food_set, portions),
+            self.target_vector,
+            self.weights,
+            "Meal",
+        )
+        return prob, portions
+
+    def run(self):
+        prob, portions = self.build_problem()
+        solve(prob)
+        self.stop_reason = "optimal"
+        best_solution = solution_values(self.food_set, portions)
+        return best_solution, self.fitness(best_solution)
+
+    def fitness(self, chromosome):
+        deviations = np.dot(chromosome, self.nutrient_matrix) - self.target_vector
+        return math.sqrt(np.dot(deviations**2, self.weights))
+
+    def calculate_nutrients(self, chromosome):
+        total_calories, total_protein, total_carbs, total_fats = (
+            float(total) for total in np.dot(chromosome, self.nutrient_matrix)
+        )
+        return total_calories, total_protein, total_carbs, total_fats
+
+
+class JointPortionSolver:
+    """Whole-day portions for all meals in one problem.
+
+    The daily macro totals are the primary objective; each meal's deviation from its
+    split of the targets is a soft penalty, so a shortfall in one meal can be made up
+    in another. run() returns {meal: (best_solution, fitness)}, where fitness is the
+    meal's PortionSolver fitness against its own targets.
+    """
+
+    def __init__(
+        self,
+        food_sets,
+        meal_targets,
+        integer_counts=True,
+        split_penalty=MEAL_SPLIT_PENALTY,
+    ):
+        self.food_sets = food_sets  # e.g., {"Breakfast": FoodSet, "Lunch": FoodSet}
+        self.meal_targets = meal_targets  # per-meal target nutrients
+        self.integer_counts = integer_counts
+        self.split_penalty = split_penalty
+        self.stop_reason = None
+        self.meal_solvers = {
+            meal: PortionSolver(
+                food_set.food_items,
+                meal_targets[meal],
+                food_set=food_set,
+                integer_counts=integer_counts,
+            )
+            for meal, food_set in food_sets.items()
+        }
+
+    def build_problem(self):
+        prob = pulp.LpProblem("Day_Portions", pulp.LpMinimize)
+        portions = {}
+        daily_totals = [0] * len(NUTRIENTS)
+        split_deviation = []
+        for k, (meal, solver) in enumerate(self.meal_solvers.items()):
+            portions[meal] = portion_variables(
+                solver.food_set, f"M{k}", self.integer_counts
+            )
+            totals = nutrient_totals(solver.food_set, portions[meal])
+            daily_totals = [daily + total for daily, total in zip(daily_totals, totals)]
+            split_deviation.append(
+                weighted_deviation(
+                    prob, totals, solver.target_vector, solver.weights, f"M{k}"
+                )
+            )
+
+        daily_target = sum(
+            solver.target_vector for solver in self.meal_solvers.values()
+        )
+        daily_weights = np.array([1, 1, 1, 1], dtype=float)
+        if any(food_set.protein_weight > 1 for food_set in self.food_sets.values()):
+            daily_weights[1] = HIGH_PROTEIN_WEIGHT
+        prob += weighted_deviation(
+            prob, daily_totals, daily_target, daily_weights, "Day"
+        ) + self.split_penalty * pulp.lpSum(split_deviation)
+        return prob, portions
+
+    def run(self):
+        prob, portions = self.build_problem()
+        solve(prob)
+        self.stop_reason = "optimal"
+        results = {}
+        for meal, solver in self.meal_solvers.items():
+            best_solution = solution_values(solver.food_set, portions[meal])
+            results[meal] = (best_solution, solver.fitness(best_solution))
+        return results
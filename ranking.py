@@ -0,0 +1,44 @@
+import numpy as np
+
+# Alternatives kept from a food's own reverse cluster, then from the other clusters
+TOP_WITHIN_CLUSTER = 2
+TOP_OUTSIDE_CLUSTER = 3
+# Most alternatives a request may ask for from each of the two
+MAX_ALTERNATIVES = 50
+
+
+def top_k(indices, scores, k):
+    """Return the k indices with the lowest scores, ordered by score and then index.
+
+    Gives the same result as a full sort of the (score, index) pairs sliced to [:k],
+    with NaN scores last, but only the k best rows and their ties get sorted.
+    """
+    indices = np.asarray(indices)
+    scores = np.asarray(scores, dtype=float)
+    if k <= 0:
+        return indices[:0]
+    if len(indices) > k:
+        kth_score = scores[np.argpartition(scores, k - 1)[:k]].max()
+        if not np.isnan(kth_score):
+            # Keep every tie with the k-th score so the order stays exact
+            keep = scores <= kth_score
+            indices, scores = indices[keep], scores[keep]
+    return indices[np.lexsort((indices, scores))[:k]]
+
+
+def grouped_top_k(
+    indices,
+    scores,
+    in_group,
+    k_within=TOP_WITHIN_CLUSTER,
+    k_outside=TOP_OUTSIDE_CLUSTER,
+):
+    """Return the k_within best indices inside the group, followed by the k_outside best outside it."""
+    indices = np.asarray(indices)
+    scores = np.asarray(scores, dtype=float)
+    return np.concatenate(
+        [
+            top_k(indices[in_group], scores[in_group], k_within),
+            top_k(indices[~in_group], scores[~in_group], k_outside),
+        ]
+    )
@@ -1,6 +1,36 @@
+import logging
+import numpy as np
+from food_catalog import get_catalog
+from ranking import top_k
+from structured_logging import log_payload
+
+logger = logging.getLogger(__name__)
+
+# Macros compared for a replacement, and their catalog columns
+MACROS = ["calories", "protein", "carbs", "fats"]
+MACRO_COLUMNS = ["CALORIES", "PROTEIN", "NET CARBS", "FATS"]
+
+
 class RecommendationEngine:
     def __init__(self, df):
         self.df = df
+        self.catalog = get_catalog(df)
+        self.categories = self.build_category_index()
+
+    def build_category_index(self):
+        """Group the catalog by CATEGORY into (names, contiguous macro array) pairs."""
+        macros = np.column_stack(
+            [self.catalog.arrays[column] for column in MACRO_COLUMNS]
+        )
+        return {
+            category: (
+                self.catalog.food_names[rows],
+                np.ascontiguousarray(macros[rows]),
+            )
+            for category, rows in self.df.groupby(
+                "CATEGORY", sort=False
+            ).indices.items()
+        }
 
     def calculate_differences(self, item, target_macros):
         """Calculate the absolute differences between the item's macros and the target macros."""
@@ -102,7 +132,7 @@ class RecommendationEngine:
     def recommend_removal(self, meal_details, target_macros, threshold=20):
         recommendations = []
 
-        print("Meal details: ", meal_details)  # Debugging log
+        log_payload(logger, "Meal details", meal_details)
 
         if "items" not in meal_details:
             return []  # Return empty if 'items' key is missing
@@ -116,41 +146,36 @@ class RecommendationEngine:
 
     def recommend_replacement(self, item, target_macros, threshold=20):
         """Recommend an alternative item from the database to replace the one being removed."""
-        differences = self.calculate_differences(item, target_macros)
-
-        # Filter the dataset to only include items that are similar in type to the one being removed
-        similar_items = self.df[self.df["CATEGORY"] == item["category"]]
-
-        best_replacement = None
-        best_fit_score = float("inf")
-
-        for _, row in similar_items.iterrows():
-            row_item = {
-                "name": row["FOOD ITEM"],
-                "macros": {
-                    "calories": row["CALORIES"],
-                    "protein": row["PROTEIN"],
-                    "carbs": row["NET CARBS"],
-                    "fats": row["FATS"],
-                },
-            }
-            row_differences = self.calculate_differences(row_item, target_macros)
-            row_fit_score = sum(abs(v) for v in row_differences.values())
-
-            if row_fit_score < best_fit_score:
-                best_fit_score = row_fit_score
-                best_replacement = row_item
-
-        return best_replacement
+        # Only consider items that are similar in type to the one being removed
+        category = item.get("category")
+        if category is None:
+            food = self.catalog.get(item["name"])
+            category = food["CATEGORY"] if food is not None else None
+        if category not in self.categories:
+            return None
+        names, macros = self.categories[category]
+
+        # Fit score of every candidate at once: sum of absolute macro differences
+        target = np.array([target_macros[macro] for macro in MACROS], dtype=float)
+        fit_scores = np.abs(macros - target).sum(axis=1)
+        best = top_k(np.arange(len(names)), fit_scores, 1)
+        if not len(best) or np.isnan(fit_scores[best[0]]):
+            return None
+        best = best[0]
+
+        return {"name": names[best], "macros": dict(zip(MACROS, macros[best].tolist()))}
 
     def generate_recommendations(self, meal_plan, target_macros, threshold=20):
         """Generate a list of recommendations for items to remove or replace in the meal plan."""
-        recommendations = self.recommend_removal(meal_plan, target_macros, threshold)
+        recommendations = {}
 
-        for meal, items in recommendations.items():
-            for rec in items:
+        for meal, meal_details in meal_plan.items():
+            recommendations[meal] = self.recommend_removal(
+                meal_details, target_macros[meal], threshold
+            )
+            for rec in recommendations[meal]:
                 item_to_remove = rec["item"]
-                for details in meal_plan[meal]["items"]:
+                for details in meal_details["items"]:
                     if details["name"] == item_to_remove:
                         best_replacement = self.recommend_replacement(
                             details, target_macros[meal], threshold
@@ -1,11 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from typing import Optional
 from recommendation import RecommendationEngine
 import pandas as pd
 
 # Load your food data
 df = pd.read_csv("updated_food_data_with_clusters.csv")
 
+# Built once at startup; it groups the catalog by category for replacements
+recommendation_engine = RecommendationEngine(df)
+
 app = FastAPI()
 
 
@@ -13,6 +17,7 @@ app = FastAPI()
 class MealItem(BaseModel):
     name: str
     macros: dict  # Example: {"calories": 500, "protein": 30, "carbs": 50, "fats": 20}
+    category: Optional[str] = None  # Looked up from the food data when omitted
 
 
 class MealDetails(BaseModel):
@@ -41,17 +46,20 @@ class RecommendationInput(BaseModel):
 def generate_recommendations(recommendation_input: RecommendationInput):
     """Endpoint to generate meal recommendations based on input meal plan and target macros."""
 
-    # Initialize RecommendationEngine
-    recommendation_engine = RecommendationEngine(df)
-
-    # Extract the meal plan and target macros
-    meal_plan = recommendation_input.meal_plan
-    target_macros = recommendation_input.target_macros
+    # Extract the meal plan and target macros as plain dictionaries
+    meal_plan = recommendation_input.meal_plan.model_dump()
+    target_macros = {
+        meal: target.model_dump()
+        for meal, target in recommendation_input.target_macros.items()
+    }
 
     # Generate recommendations
-    recommendations = recommendation_engine.generate_recommendations(
-        meal_plan=meal_plan.meals, target_macros=target_macros
-    )
+    try:
+        recommendations = recommendation_engine.generate_recommendations(
+            meal_plan=meal_plan["meals"], target_macros=target_macros
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"No target macros for meal {e}")
 
     if not recommendations:
         raise HTTPException(status_code=400, detail="Recommendation generation failed.")
@@ -1,12 +1,76 @@
 import pandas as pd
+import numpy as np
 import logging
+from cache import LRUCache
+from food_catalog import get_catalog
+from ranking import TOP_OUTSIDE_CLUSTER, TOP_WITHIN_CLUSTER, grouped_top_k
+from structured_logging import log_payload
+
+logger = logging.getLogger(__name__)
+
+# Nutrients reported per alternative, and the catalog columns scaled for each
+PORTION_NUTRIENTS = ["calories", "protein", "carbs", "fats", "sugars", "fiber"]
+PORTION_COLUMNS = ["PROTEIN", "NET CARBS", "FATS", "TOTAL SUGARS", "DIETARY FIBRE"]
+
+# Catalog column for the critical nutrients a search can prune on
+NUTRIENT_COLUMNS = {"protein": "PROTEIN", "carbs": "NET CARBS", "fats": "FATS"}
+# Direction to move a nutrient when the plan's shortfall/excess is not known,
+# matching the similarity score (more protein, less carbs and fats)
+DEFAULT_NUTRIENT_DIRECTIONS = {"protein": 1, "carbs": -1, "fats": -1}
+
+# Engines are built per request, so results are memoized at module level. Keys
+# carry the catalog version, so a reloaded catalog never reuses stale entries.
+ALTERNATIVE_CACHE_SIZE = 2048
+PORTION_CACHE_SIZE = 16384
+RECOMMENDATION_CACHE_TTL = 3600
+# Item calories are rounded to this many decimals for portion cache keys
+PORTION_CALORIE_DECIMALS = 2
+alternative_cache = LRUCache(
+    maxsize=ALTERNATIVE_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL
+)
+portion_cache = LRUCache(maxsize=PORTION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL)
+
+
+def cache_stats():
+    """Return the hit/miss counters of the recommendation caches."""
+    return {
+        "alternatives": alternative_cache.stats(),
+        "portions": portion_cache.stats(),
+    }
 
 
 class RecommendationEngine:
-    def __init__(self, df, target_nutrients):
+    def __init__(
+        self,
+        df,
+        target_nutrients,
+        index=None,
+        catalog=None,
+        macro_index=None,
+        prune_by_nutrient=False,
+        top_within=TOP_WITHIN_CLUSTER,
+        top_outside=TOP_OUTSIDE_CLUSTER,
+    ):
         self.df = df
         self.target_nutrients = target_nutrients
-        logging.debug(
+        # Optional AlternativeIndex built at startup; searches become lookups
+        self.index = index
+        # Optional MacroIndex; when given, alternatives are nearest neighbours in
+        # macro space, moved towards the critical nutrient
+        self.macro_index = macro_index
+        # Only consider foods that move the critical nutrient the right way
+        self.prune_by_nutrient = prune_by_nutrient
+        # Alternatives kept from the food's reverse cluster, then from the others
+        self.top_within = top_within
+        self.top_outside = top_outside
+        # Shared FoodCatalog for O(1) lookups by name and typed column arrays
+        self.catalog = catalog if catalog is not None else get_catalog(df)
+        self.food_names = self.catalog.food_names
+        self.protein = self.catalog.arrays["PROTEIN"]
+        self.carbs = self.catalog.arrays["NET CARBS"]
+        self.fats = self.catalog.arrays["FATS"]
+        self.reverse_clusters = self.catalog.arrays["Reverse_Cluster_Number"]
+        logger.debug(
             "Initialized RecommendationEngine with target nutrients: %s",
             target_nutrients,
         )
@@ -29,10 +93,10 @@ class RecommendationEngine:
                 total_shortfall_excess["carbs"] += macros.get("carbs", 0)
                 total_shortfall_excess["fats"] += macros.get("fats", 0)
             except AttributeError as e:
-                logging.error("Meal plan structure invalid: %s", e)
+                logger.error("Meal plan structure invalid: %s", e)
                 raise ValueError("Invalid meal plan structure") from e
 
-        logging.debug(
+        logger.debug(
             "Total shortfall/excess before normalization: %s", total_shortfall_excess
         )
 
@@ -57,7 +121,7 @@ class RecommendationEngine:
             / self.target_nutrients["fats"]
         )
 
-        logging.debug(
+        logger.debug(
             "Total shortfall/excess after normalization: %s", total_shortfall_excess
         )
 
@@ -68,64 +132,152 @@ class RecommendationEngine:
         critical_nutrient = max(
             total_shortfall_excess, key=lambda k: abs(total_shortfall_excess[k])
         )
-        logging.debug("Identified critical nutrient: %s", critical_nutrient)
+        logger.debug("Identified critical nutrient: %s", critical_nutrient)
         return critical_nutrient
 
-    def search_alternatives(self, food_name, nutrient_priority, top_n=5):
+    def nutrient_direction(self, total_shortfall_excess, nutrient):
+        """Return 1 if the nutrient should go up (shortfall), -1 if down (excess), 0 if on target."""
+        return -int(np.sign(total_shortfall_excess[nutrient]))
+
+    def search_alternatives(
+        self, food_name, nutrient_priority, top_n=5, direction=None
+    ):
         """Search alternatives for a given food item within the same cluster, and then from other clusters."""
-        logging.debug("Searching alternatives for food item: %s", food_name)
+        logger.debug("Searching alternatives for food item: %s", food_name)
 
-        carb_column = "NET CARBS"
-        cluster_column = "Cluster_Number"
-        reverse_cluster_column = "Reverse_Cluster_Number"
+        key = self.alternative_key(food_name, nutrient_priority, direction)
+        alternatives = alternative_cache.get(key)
+        if alternatives is None:
+            alternatives = self.rank_alternatives(
+                food_name, nutrient_priority, direction
+            )
+            alternative_cache.set(key, alternatives)
 
-        # Find the target food item
-        target_food = self.df[self.df["FOOD ITEM"] == food_name].iloc[0]
-        target_cluster = target_food[cluster_column]
-        reverse_target_cluster = target_food[reverse_cluster_column]
-
-        similarities_within_cluster = []
-        similarities_outside_cluster = []
-
-        for _, row in self.df.iterrows():
-            if row["FOOD ITEM"] != food_name:
-                similarity = 0
-                similarity += abs(target_food["PROTEIN"] - row["PROTEIN"]) * (
-                    -1 if row["PROTEIN"] > target_food["PROTEIN"] else 1
-                )
-                similarity += abs(target_food[carb_column] - row[carb_column]) * (
-                    1 if row[carb_column] > target_food[carb_column] else -1
-                )
+        return alternatives[:top_n]
 
-                similarity += abs(target_food["FATS"] - row["FATS"]) * (
-                    1 if row["FATS"] > target_food["FATS"] else -1
-                )
+    def alternative_key(self, food_name, nutrient_priority=None, direction=None):
+        """Cache key for the ranked alternatives of a food."""
+        if self.prune_by_nutrient and self.macro_index is None:
+            mode = ("nutrient", nutrient_priority, direction)
+        elif self.macro_index is not None:
+            # Nearest-neighbour results depend on the index and the critical
+            # nutrient's direction
+            mode = (id(self.macro_index), nutrient_priority, direction)
+        else:
+            mode = self.index is None
+        return (
+            self.catalog.version,
+            mode,
+            self.top_within,
+            self.top_outside,
+            food_name,
+        )
 
-                if row[reverse_cluster_column] == reverse_target_cluster:
-                    similarities_within_cluster.append((row["FOOD ITEM"], similarity))
-                else:
-                    similarities_outside_cluster.append((row["FOOD ITEM"], similarity))
+    def rank_alternatives(self, food_name, nutrient_priority=None, direction=None):
+        """Rank alternatives within the same reverse cluster first, then from other clusters."""
+        if self.macro_index is not None:
+            return self.macro_index.alternatives(
+                food_name,
+                nutrient_priority,
+                self.top_within,
+                self.top_outside,
+                direction,
+            )
+        if self.prune_by_nutrient:
+            return self.rank_nutrient_alternatives(
+                food_name, nutrient_priority, direction
+            )
+        if self.index is not None:
+            return self.index.search(food_name, self.top_within, self.top_outside)
 
-        logging.debug(
-            "Found %s alternatives within the same cluster",
-            len(similarities_within_cluster),
+        # Find the target food item
+        target_index = self.catalog.index_of(food_name)
+        if target_index is None:
+            raise ValueError(f"Food item {food_name} not found.")
+
+        # Signed similarity for every row at once: more protein, less carbs and
+        # less fat than the target food score lower (better)
+        similarities = (
+            (self.protein[target_index] - self.protein)
+            + (self.carbs - self.carbs[target_index])
+            + (self.fats - self.fats[target_index])
         )
-        logging.debug(
-            "Found %s alternatives outside the cluster",
-            len(similarities_outside_cluster),
+        candidates = np.flatnonzero(
+            (self.food_names != food_name) & self.catalog.searchable
+        )
+        same_cluster = (
+            self.reverse_clusters[candidates] == self.reverse_clusters[target_index]
         )
 
-        # Sort similarities
-        similarities_within_cluster.sort(key=lambda x: x[1], reverse=False)
-        similarities_outside_cluster.sort(key=lambda x: x[1])
-
-        # Return top N alternatives, with priority to the same cluster
-        alternatives = (
-            similarities_within_cluster[:2] + similarities_outside_cluster[:3]
+        logger.debug(
+            "Found %s alternatives within the same cluster", same_cluster.sum()
         )
-        logging.debug("Returning top %s alternatives for %s", top_n, food_name)
+        logger.debug("Found %s alternatives outside the cluster", (~same_cluster).sum())
+
+        # Top alternatives, with priority to the same cluster
+        return [
+            (self.food_names[i], similarities[i])
+            for i in grouped_top_k(
+                candidates,
+                similarities[candidates],
+                same_cluster,
+                self.top_within,
+                self.top_outside,
+            )
+        ]
 
-        return alternatives[:top_n]
+    def nutrient_candidates(self, target_index, nutrient_priority, direction=None):
+        """Rows whose nutrient per 100 kcal moves past the target's in the given direction.
+
+        Returns None when the nutrient cannot prune (e.g. calories, which stay the
+        same at equal-calorie portions).
+        """
+        column = NUTRIENT_COLUMNS.get(nutrient_priority)
+        if column is None:
+            return None
+        if direction is None:
+            direction = DEFAULT_NUTRIENT_DIRECTIONS[nutrient_priority]
+        target_density = self.catalog.density(column)[target_index]
+        if not direction or np.isnan(target_density):
+            return None
+
+        rows, densities = self.catalog.density_order(column)
+        if direction > 0:
+            return rows[np.searchsorted(densities, target_density, side="right") :]
+        return rows[: np.searchsorted(densities, target_density, side="left")]
+
+    def rank_nutrient_alternatives(self, food_name, nutrient_priority, direction=None):
+        """Rank alternatives like rank_alternatives, among the foods that improve the critical nutrient only."""
+        target_index = self.catalog.index_of(food_name)
+        if target_index is None:
+            raise ValueError(f"Food item {food_name} not found.")
+        candidates = self.nutrient_candidates(
+            target_index, nutrient_priority, direction
+        )
+        if candidates is None:
+            candidates = np.flatnonzero(self.catalog.searchable)
+        # Row order, so ties break like the full scan
+        candidates = np.sort(candidates)
+        candidates = candidates[self.food_names[candidates] != food_name]
+
+        similarities = (
+            (self.protein[target_index] - self.protein[candidates])
+            + (self.carbs[candidates] - self.carbs[target_index])
+            + (self.fats[candidates] - self.fats[target_index])
+        )
+        same_cluster = (
+            self.reverse_clusters[candidates] == self.reverse_clusters[target_index]
+        )
+        positions = grouped_top_k(
+            np.arange(len(candidates)),
+            similarities,
+            same_cluster,
+            self.top_within,
+            self.top_outside,
+        )
+        return list(
+            zip(self.food_names[candidates[positions]], similarities[positions])
+        )
 
     # def generate_recommendations(self, meal_plan, threshold=10):
     #     """Generate a list of recommendations for items to remove or replace in the meal plan."""
@@ -176,84 +328,277 @@ class RecommendationEngine:
         """Generate a list of recommendations for items to remove or replace in the meal plan."""
         all_recommendations = []
 
-        logging.debug("Starting recommendation generation for meal plan")
+        logger.debug("Starting recommendation generation for meal plan")
 
         try:
-            # Calculate the total shortfall or excess for each nutrient
-            total_shortfall_excess = self.post_genetic_algorithm_nutrient_calculation(
-                meal_plan
-            )
-            logging.debug(
-                "Total shortfall/excess calculated: %s", total_shortfall_excess
-            )
+            all_recommendations = list(self.iter_recommendations(meal_plan))
+            log_payload(logger, "Generated recommendations", all_recommendations)
+
+        except Exception as e:
+            logger.error("Error during recommendation generation: %s", e)
+            raise
 
-            # Identify the critical nutrient
-            critical_nutrient = self.identify_critical_nutrient(total_shortfall_excess)
-            logging.debug("Critical nutrient: %s", critical_nutrient)
+        return all_recommendations
 
-            for meal_name, meal_details in meal_plan.items():
-                for item in meal_details["items"]:
-                    logging.debug(
-                        "Evaluating item %s in meal %s", item["name"], meal_name
+    def iter_recommendations(self, meal_plan):
+        """Yield the recommendation for each item of the meal plan as soon as it is computed."""
+        # Calculate the total shortfall or excess for each nutrient
+        total_shortfall_excess = self.post_genetic_algorithm_nutrient_calculation(
+            meal_plan
+        )
+        logger.debug("Total shortfall/excess calculated: %s", total_shortfall_excess)
+
+        # Identify the critical nutrient
+        critical_nutrient = self.identify_critical_nutrient(total_shortfall_excess)
+        direction = self.nutrient_direction(total_shortfall_excess, critical_nutrient)
+        logger.debug("Critical nutrient: %s", critical_nutrient)
+
+        for meal_name, meal_details in meal_plan.items():
+            for item in meal_details["items"]:
+                logger.debug("Evaluating item %s in meal %s", item["name"], meal_name)
+
+                if critical_nutrient in item["macros"]:
+                    # Get food alternatives with focus on the critical nutrient
+                    alternatives = self.search_alternatives(
+                        food_name=item["name"],
+                        nutrient_priority=critical_nutrient,
+                        top_n=self.top_within + self.top_outside,
+                        direction=direction,
                     )
 
-                    if critical_nutrient in item["macros"]:
-                        # Get food alternatives with focus on the critical nutrient
-                        alternatives = self.search_alternatives(
-                            food_name=item["name"], nutrient_priority=critical_nutrient
+                    if alternatives:
+                        names = [name for name, _ in alternatives]
+                        original = np.array(
+                            [
+                                item["macros"].get(nutrient, 0)
+                                for nutrient in PORTION_NUTRIENTS
+                            ],
+                            dtype=float,
+                        )
+                        quantities, deviations = self.portion_deviations(
+                            [item["name"]] * len(names), names, original[None, :]
                         )
 
-                        if alternatives:
-                            deviations = []
-                            for alternative in alternatives:
-                                # Calculate nutrient values for each alternative
-                                recommended_nutrients = (
-                                    self.calculate_nutrient_per_portion(
-                                        self.df[
-                                            self.df["FOOD ITEM"] == alternative[0]
-                                        ].iloc[0],
-                                        item["macros"][
-                                            "calories"
-                                        ],  # Keep the original item's calories
-                                        item,
-                                    )
-                                )
-
-                                # Calculate deviation from the original food
-                                deviation = self.calculate_nutrient_deviation(
-                                    item["macros"], recommended_nutrients
-                                )
-                                deviations.append(
-                                    {
-                                        "alternative": alternative[0],
-                                        "deviation": deviation,
-                                        "quantity": recommended_nutrients[
-                                            "quantity"
-                                        ],  # Include the quantity for the alternative
-                                    }
-                                )
-
-                            # Add to recommendations with deviations and original item quantity
-                            all_recommendations.append(
+                        # Yield the recommendation with deviations and original item quantity
+                        yield {
+                            "meal": meal_name,
+                            "item": item["name"],
+                            "issue": f"Optimize {critical_nutrient.capitalize()}",
+                            "alternatives": [
                                 {
-                                    "meal": meal_name,
-                                    "item": item["name"],
-                                    "issue": f"Optimize {critical_nutrient.capitalize()}",
-                                    "alternatives": deviations,
-                                    "original_quantity": item.get(
-                                        "quantity", "Unknown quantity"
-                                    ),  # Include original item's quantity
+                                    "alternative": name,
+                                    "deviation": dict(
+                                        zip(PORTION_NUTRIENTS, deviations[row])
+                                    ),
+                                    "quantity": f"{quantities[row]:.2f} g",
                                 }
-                            )
+                                for row, name in enumerate(names)
+                            ],
+                            "original_quantity": item.get(
+                                "quantity", "Unknown quantity"
+                            ),  # Include original item's quantity
+                        }
+
+    def generate_recommendations_batch(self, meal_plan):
+        """Generate the same recommendations as generate_recommendations for every item in one vectorized pass."""
+        total_shortfall_excess = self.post_genetic_algorithm_nutrient_calculation(
+            meal_plan
+        )
+        critical_nutrient = self.identify_critical_nutrient(total_shortfall_excess)
+        direction = self.nutrient_direction(total_shortfall_excess, critical_nutrient)
+
+        items = [
+            (meal_name, item)
+            for meal_name, meal_details in meal_plan.items()
+            for item in meal_details["items"]
+            if critical_nutrient in item["macros"]
+        ]
+        alternatives = self.batch_alternatives(
+            list(dict.fromkeys(item["name"] for _, item in items)),
+            critical_nutrient,
+            direction,
+        )
 
-            logging.debug("Generated recommendations: %s", all_recommendations)
+        # One row per (item, alternative) pair
+        pairs = [
+            (position, name)
+            for position, (_, item) in enumerate(items)
+            for name in alternatives[item["name"]]
+        ]
+        if not pairs:
+            return []
+        item_rows = np.array([position for position, _ in pairs])
+        original = np.array(
+            [
+                [item["macros"].get(nutrient, 0) for nutrient in PORTION_NUTRIENTS]
+                for _, item in items
+            ],
+            dtype=float,
+        )[item_rows]
+
+        quantities, deviations = self.portion_deviations(
+            [items[position][1]["name"] for position, _ in pairs],
+            [name for _, name in pairs],
+            original,
+        )
 
-        except Exception as e:
-            logging.error("Error during recommendation generation: %s", e)
-            raise
+        all_recommendations = []
+        pair = 0
+        for meal_name, item in items:
+            count = len(alternatives[item["name"]])
+            if not count:
+                continue
+            all_recommendations.append(
+                {
+                    "meal": meal_name,
+                    "item": item["name"],
+                    "issue": f"Optimize {critical_nutrient.capitalize()}",
+                    "alternatives": [
+                        {
+                            "alternative": pairs[row][1],
+                            "deviation": dict(zip(PORTION_NUTRIENTS, deviations[row])),
+                            "quantity": f"{quantities[row]:.2f} g",
+                        }
+                        for row in range(pair, pair + count)
+                    ],
+                    "original_quantity": item.get("quantity", "Unknown quantity"),
+                }
+            )
+            pair += count
 
+        logger.debug(
+            "Generated %s batch recommendations for %s items",
+            len(all_recommendations),
+            len(items),
+        )
         return all_recommendations
 
+    def portion_deviations(self, food_names, alternatives, original):
+        """Return (quantities, deviations) of each alternative at the calories of its food.
+
+        original holds the food's PORTION_NUTRIENTS, one row per pair (or a single
+        row for all). Portions are memoized per (food, alternative, rounded calories)
+        in portion_cache, so every recommendation path gets the same portions.
+        """
+        original = np.broadcast_to(
+            original, (len(alternatives), len(PORTION_NUTRIENTS))
+        )
+        calories = np.round(original[:, 0], PORTION_CALORIE_DECIMALS).tolist()
+        keys = [
+            (self.catalog.version, food_name, alternative, calories[row])
+            for row, (food_name, alternative) in enumerate(
+                zip(food_names, alternatives)
+            )
+        ]
+        portions = [portion_cache.get(key) for key in keys]
+        missing = [row for row, portion in enumerate(portions) if portion is None]
+        if missing:
+            computed = self.portions(
+                [alternatives[row] for row in missing],
+                [calories[row] for row in missing],
+            )
+            for row, portion in zip(missing, computed):
+                portion_cache.set(keys[row], portion)
+                portions[row] = portion
+        portions = np.array(portions)
+        recommended = np.column_stack([original[:, 0], portions[:, 1:]])
+        return portions[:, 0], (recommended - original).tolist()
+
+    def portions(self, alternatives, calories):
+        """Return [quantity, protein, carbs, fats, sugars, fiber] for each alternative at the given calories."""
+        rows = np.array([self.catalog.index_of(name) for name in alternatives])
+        calories = np.array(calories, dtype=float)
+        calories_per_100g = self.catalog.arrays["CALORIES"][rows]
+        invalid = np.flatnonzero(
+            (calories_per_100g == 0) | ~np.isfinite(calories_per_100g)
+        )
+        if len(invalid):
+            name = alternatives[invalid[0]]
+            if calories_per_100g[invalid[0]] == 0:
+                raise ValueError(f"Alternative food {name} has zero calories.")
+            raise ValueError(f"Alternative food {name} has no calorie data.")
+
+        quantities = (calories / calories_per_100g) * 100
+        columns = np.column_stack(
+            [
+                self.catalog.arrays.get(column, np.zeros(len(self.catalog)))[rows]
+                for column in PORTION_COLUMNS
+            ]
+        )
+        portions = np.column_stack([quantities, (columns * quantities[:, None]) / 100])
+        return [tuple(portion) for portion in portions.tolist()]
+
+    def batch_alternatives(self, food_names, nutrient_priority=None, direction=None):
+        """Return the alternative names for each food, scoring uncached foods against the catalog at once."""
+        keys = {
+            name: self.alternative_key(name, nutrient_priority, direction)
+            for name in food_names
+        }
+        alternatives = {}
+        missing = []
+        for name in food_names:
+            cached = alternative_cache.get(keys[name])
+            if cached is None:
+                missing.append(name)
+            else:
+                alternatives[name] = cached
+        if (
+            self.index is not None
+            or self.macro_index is not None
+            or self.prune_by_nutrient
+        ):
+            alternatives.update(
+                {
+                    name: self.rank_alternatives(name, nutrient_priority, direction)
+                    for name in missing
+                }
+            )
+        elif missing:
+            alternatives.update(self.rank_alternatives_batch(missing))
+        for name in missing:
+            alternative_cache.set(keys[name], alternatives[name])
+
+        return {
+            name: [alternative for alternative, _ in alternatives[name]]
+            for name in food_names
+        }
+
+    def rank_alternatives_batch(self, food_names):
+        """Rank alternatives for several foods with one items x catalog similarity matrix."""
+        targets = []
+        for name in food_names:
+            target_index = self.catalog.index_of(name)
+            if target_index is None:
+                raise ValueError(f"Food item {name} not found.")
+            targets.append(target_index)
+        targets = np.array(targets, dtype=int)
+
+        # Same formula as rank_alternatives, one row per food
+        similarities = (
+            (self.protein[targets, None] - self.protein)
+            + (self.carbs - self.carbs[targets, None])
+            + (self.fats - self.fats[targets, None])
+        )
+        candidates = (
+            self.food_names != np.array(food_names, dtype=object)[:, None]
+        ) & self.catalog.searchable
+        same_cluster = self.reverse_clusters == self.reverse_clusters[targets, None]
+
+        alternatives = {}
+        for row, name in enumerate(food_names):
+            rows = np.flatnonzero(candidates[row])
+            alternatives[name] = [
+                (self.food_names[i], similarities[row, i])
+                for i in grouped_top_k(
+                    rows,
+                    similarities[row, rows],
+                    same_cluster[row, rows],
+                    self.top_within,
+                    self.top_outside,
+                )
+            ]
+        return alternatives
+
     def calculate_nutrient_per_portion(
         self, alternative, original_calories, original_food
     ):
@@ -0,0 +1,165 @@
+import contextvars
+import json
+import logging
+import random
+import uuid
+import config
+
+# Structured logging for the API: per-module levels from config, one record per
+# line (text or JSON) carrying the id of the request it belongs to, and full
+# payload dumps (plans, recommendations) only for a sampled share of requests.
+
+# Id of the request being handled, added to every record
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# Whether log_payload() dumps payloads for the current request
+payload_sampled_var = contextvars.ContextVar("payload_sampled", default=None)
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+_configured = False
+
+
+class LazyJson:
+    """Wraps a value so it is serialized to JSON only if a handler formats it."""
+
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, default=to_json)
+
+
+def to_json(value):
+    """JSON fallback for values json can't serialize (e.g. pydantic models)."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id to every record."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT, followed by the record's payload if it has one."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        message = super().format(record)
+        if hasattr(record, "payload"):
+            message += f" {record.payload}"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, request id, message and extra fields."""
+
+    # Attributes every LogRecord has, which are not extra fields
+    RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in self.RECORD_ATTRIBUTES and name not in entry:
+                entry[name] = value.value if isinstance(value, LazyJson) else value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=to_json)
+
+
+def parse_levels(levels):
+    """Parse "module=LEVEL,other.module=LEVEL" into {logger name: level}."""
+    parsed = {}
+    for item in levels.split(","):
+        if not item.strip():
+            continue
+        name, sep, level = item.partition("=")
+        if not sep:
+            raise ValueError(f"Log level must look like module=LEVEL: {item}")
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def configure(level=None, levels=None, log_format=None, force=False):
+    """Set up the root handler and the per-module levels (from config by default).
+
+    Only the first call takes effect unless force is set, so every process
+    (API and request workers) can call it on startup.
+    """
+    global _configured
+    if _configured and not force:
+        return
+    log_format = log_format or config.LOG_FORMAT
+    if log_format not in ("text", "json"):
+        raise ValueError(f"Log format must be text or json: {log_format}")
+
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel((level or config.LOG_LEVEL).upper())
+    for name, module_level in parse_levels(
+        config.LOG_LEVELS if levels is None else levels
+    ).items():
+        logging.getLogger(name).setLevel(module_level)
+    _configured = True
+
+
+def new_request(request_id=None):
+    """Start the logging context of a request (a new id unless given) and return its id.
+
+    Whether the request's payloads are dumped is drawn here, once, so a sampled
+    request gets all of its payloads logged.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    payload_sampled_var.set(random.random() < config.LOG_PAYLOAD_SAMPLE_RATE)
+    return request_id
+
+
+def request_context():
+    """The current request's logging context, to hand to run_in_request()."""
+    return request_id_var.get(), payload_sampled_var.get()
+
+
+def run_in_request(context, function, *args):
+    """Run function(*args) in a request's logging context, e.g. on a worker pool."""
+    request_id, sampled = context
+    request_token = request_id_var.set(request_id)
+    sampled_token = payload_sampled_var.set(sampled)
+    try:
+        return function(*args)
+    finally:
+        request_id_var.reset(request_token)
+        payload_sampled_var.reset(sampled_token)
+
+
+def log_payload(logger, message, payload):
+    """Log a full payload at DEBUG for the sampled requests, serialized only when emitted.
+
+    Outside a request, each call is sampled on its own.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sampled = payload_sampled_var.get()
+    if sampled is None:
+        sampled = random.random() < config.LOG_PAYLOAD_SAMPLE_RATE
+    if sampled:
+        logger.debug(message, extra={"payload": LazyJson(payload)})